@@ -0,0 +1,104 @@
+/**
+Canvas of the sugar field and the agents, drawn from the full and delta
+frames of canvas.DeltaCanvasGrid.
+
+The module keeps the color of every cell and whether it holds agents of
+every breed, and after a delta frame only the cells that changed are
+painted again. A cell is painted with its color, the images of the
+breeds on it and its grid lines.
+*/
+
+var DeltaCanvasModule = function(canvas_width, canvas_height, grid_width, grid_height, images) {
+	var canvas = $(`<canvas width="${canvas_width}" height="${canvas_height}" class="world-grid"/>`)[0];
+	var parent = $('<div style="height:' + canvas_height + 'px;" class="world-grid-parent"></div>')[0];
+	$("#elements").append(parent);
+	parent.append(canvas);
+	var context = canvas.getContext("2d");
+
+	var cellWidth = Math.floor(canvas_width / grid_width);
+	var cellHeight = Math.floor(canvas_height / grid_height);
+	var cells = grid_width * grid_height;
+
+	// the state of the last frame
+	var palette = [];
+	var colors = new Int32Array(cells);
+	var occupied = images.map(() => new Uint8Array(cells));
+
+	// the images are loaded once; cells with agents are painted again
+	// when an image arrives
+	images.forEach(function(image) {
+		image.img = new Image();
+		image.img.onload = function() {
+			for (var cell = 0; cell < cells; cell++)
+				paintCell(cell);
+		};
+		image.img.src = "local/".concat(image.image);
+	});
+
+	var paintCell = function(cell) {
+		// flat cell indices are x * height + y, with y up
+		var x = Math.floor(cell / grid_height) * cellWidth;
+		var y = (grid_height - cell % grid_height - 1) * cellHeight;
+
+		context.fillStyle = palette[colors[cell]];
+		context.fillRect(x, y, cellWidth, cellHeight);
+
+		images.forEach(function(image, breed) {
+			if (occupied[breed][cell] && image.img.complete) {
+				var width = cellWidth * image.scale;
+				var height = cellHeight * image.scale;
+				context.drawImage(
+					image.img,
+					x + (cellWidth - width) / 2,
+					y + (cellHeight - height) / 2,
+					width,
+					height
+				);
+			}
+		});
+
+		// the grid lines on the left and top of the cell
+		context.fillStyle = "#eee";
+		context.fillRect(x, y, cellWidth, 1);
+		context.fillRect(x, y, 1, cellHeight);
+	};
+
+	var paintBorder = function() {
+		context.fillStyle = "#eee";
+		context.fillRect(0, cellHeight * grid_height, cellWidth * grid_width, 1);
+		context.fillRect(cellWidth * grid_width, 0, 1, cellHeight * grid_height + 1);
+	};
+
+	this.render = function(data) {
+		if (data.full) {
+			palette = data.palette;
+			colors.set(data.colors);
+			occupied.forEach(function(layer, breed) {
+				layer.fill(0);
+				data.agents[breed].forEach(cell => layer[cell] = 1);
+			});
+			context.clearRect(0, 0, canvas_width, canvas_height);
+			for (var cell = 0; cell < cells; cell++)
+				paintCell(cell);
+			paintBorder();
+			return;
+		}
+
+		palette = palette.concat(data.palette);
+		var changed = new Set(data.cells);
+		data.cells.forEach(function(cell, i) {
+			colors[cell] = data.colors[i];
+		});
+		occupied.forEach(function(layer, breed) {
+			data.agents[breed].forEach(function(cell) {
+				layer[cell] ^= 1;
+				changed.add(cell);
+			});
+		});
+		changed.forEach(paintCell);
+	};
+
+	this.reset = function() {
+		context.clearRect(0, 0, canvas_width, canvas_height);
+	};
+};
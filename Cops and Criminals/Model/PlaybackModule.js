@@ -0,0 +1,61 @@
+/**
+Slider over the steps buffered by playback.BufferedServer.
+
+Every frame tells the step it shows and the first and last step in the
+buffer. Moving the slider stops the model and seeks to the chosen step;
+the server answers with the frames that draw all elements again from
+the first buffered step up to that step, which are played here at once.
+*/
+
+var PlaybackModule = function() {
+	var parent = $('<div class="playback"></div>')[0];
+	var slider = $('<input type="range" min="0" max="0" value="0" style="width: 500px;"/>')[0];
+	var label = $('<p></p>')[0];
+	$("#elements").append(parent);
+	parent.append(slider);
+	parent.append(label);
+
+	slider.onchange = function() {
+		controller.stop();
+		send({type: "seek", step: Number(slider.value)});
+	};
+
+	var show = function(data) {
+		slider.min = data.first;
+		slider.max = data.last;
+		slider.value = data.step;
+		label.innerText = "Buffered steps " + data.first + " to " + data.last;
+	};
+
+	// draw the replay of a seek; the other messages go to runcontrol.js
+	var onmessage = ws.onmessage;
+	ws.onmessage = function(message) {
+		var msg = JSON.parse(message.data);
+		if (msg.type !== "viz_replay") {
+			onmessage(message);
+			return;
+		}
+		vizElements.forEach(element => element.reset());
+		msg.data.forEach(function(frames, i) {
+			// the charts label their points with the tick of the controller
+			controller.tick = msg.first + i;
+			frames.forEach(function(frame, index) {
+				if (frame !== null)
+					vizElements[index].render(frame);
+			});
+		});
+		controller.tick = msg.step;
+		stepDisplay.innerText = msg.step;
+	};
+
+	this.render = function(data) {
+		// a browser that fell behind the buffer goes on from its first step
+		controller.tick = data.step;
+		stepDisplay.innerText = data.step;
+		show(data);
+	};
+
+	this.reset = function() {
+		label.innerText = "";
+	};
+};
@@ -1,7 +1,8 @@
 import math
 import numpy as np
 from mesa import Agent
-import random
+
+import kernels
 
 
 
@@ -39,52 +40,42 @@ class Criminal(Agent):
         self.does_crime = does_crime
         self.crimes_commited = crimes_commited
         self.buddy_id = buddy_id
+
+    @property
+    def random(self):
+        """
+        Returns the random number generator of the criminals.
+        """
+        return self.model.random_streams['Criminal']
     
     def get_sugar(self, pos):
         """
-        Returns the sugar class present on a given position
+        Returns the amount of sugar present on a given position
         """
-        this_cell = self.model.grid.get_cell_list_contents([pos])
-        for agent in this_cell:
-            if type(agent) is Sugar:
-                return agent
+        return self.model.sugar.amount[pos]
                 
     def get_wealth(self, pos):
         """
         Returns the wealth in a given cell
         """
-        sugar_patch = self.get_sugar(pos)
-        return sugar_patch.amount
+        return self.get_sugar(pos)
     
     def get_risk(self, pos):
         """
         Returns the risk in a given cell
         """
-        risk = 0
-        max_radius = self.risk_radius
-        neighbors = self.model.grid.get_neighbors(
-            pos, 
-            self.moore, 
-            True, 
-            max_radius
-        )
-        for n in neighbors:
-            if type(n) is Cop:
-                distance = get_distance(pos, n.pos)
-                if distance == 0: # you are on the same cell as a cop
-                    return 100
-                risk += 1 / distance
-        return risk
+        return self.model.risk_field[pos]
     
     def do_crime(self, pos):
         """
         Depletes the cell's resources and add them to the criminal's wealth
         """
-        sugar_patch = self.get_sugar(pos)
-        self.wealth += sugar_patch.amount
+        sugar = self.model.sugar
+        self.wealth += sugar.amount[pos]
         self.crimes_commited +=1
-        sugar_patch.amount = 0
-        sugar_patch.steps_since_crime = 2
+        sugar.amount[pos] = 0
+        sugar.steps_since_crime[pos] = 2
+        self.model.record_crime(pos)
 
     def get_utility(self, pos, a=1, b=1, c=0.3):
         """
@@ -137,41 +128,15 @@ class Criminal(Agent):
             radius=self.search_radius
         )
 
-        # get the utility of the neighbor cells
-        utility_scores = {}
-        for cell in own_neighborhood:
-            utility_scores[cell] = self.get_utility(cell, b=self.risk_aversion)
-
-
-        # get the utility of the cells of the buddies
-        for agents, x, y in self.model.grid.coord_iter():
-            for agent in agents:
-                if type(agent) is Criminal and (x, y) != self.pos:
-                    if agent.buddy_id == self.buddy_id:
-                        neighborhood = self.model.grid.get_neighborhood(
-                            pos=(x, y), 
-                            moore=True, 
-                            include_center=True,
-                            radius=self.search_radius
-                        )
-                        for cell in neighborhood:
-                            utility_scores[cell] = self.get_utility(
-                                cell, 
-                                b=self.risk_aversion
-                            )
-
-        # determine the cell with the highest utility
-        highest_utility = max(utility_scores.values())
-        possible_targets = [
-            cell  
-            for (cell, util) 
-            in utility_scores.items() 
-            if util == highest_utility
-        ]
+        # get the cells with the highest utility, 
+        # in the own neighborhood and the neighborhoods of the buddies
+        possible_targets, highest_utility = (
+            self.model.get_criminal_targets(self)
+        )
 
         # determine where to move
         make_buddy_move = False
-        target_cell = random.choice(possible_targets)
+        target_cell = self.random.choice(possible_targets)
 
         # move towards your buddy 
         if target_cell not in own_neighborhood: 
@@ -207,40 +172,70 @@ class Criminal(Agent):
         #daily expenses
         self.wealth -= 20
 
-class Sugar(Agent):
+class SugarField:
     """
-    Governs the behaviour of the Sugar agent.
+    Holds the sugar of every cell of the grid as arrays indexed by (x, y).
     """
-    def __init__(self, pos, model, max_sugar, steps_since_crime):
-        super().__init__(pos, model)
-        self.amount = max_sugar
-        self.max_sugar = max_sugar
-        self.steps_since_crime = steps_since_crime
+    def __init__(self, max_sugar):
+        self.max_sugar = np.array(max_sugar, dtype=float)
+        self.amount = self.max_sugar.copy()
+        self.steps_since_crime = np.zeros(self.max_sugar.shape, dtype=int)
 
     def step(self):
         """
-        Replenishes the amount of sugar on the cell after a crime.
+        Replenishes the amount of sugar on all cells after a crime,
+        in place, so references to amount stay current.
         """
-        if self.steps_since_crime > 0:
-            self.amount = self.max_sugar - 2
-            self.steps_since_crime -= 1
-        else:
-            self.amount = self.max_sugar
+        robbed = self.steps_since_crime > 0
+        np.copyto(self.amount, self.max_sugar)
+        self.amount[robbed] -= 2
+        self.steps_since_crime[robbed] -= 1
+
+    def __getitem__(self, pos):
+        return Sugar(pos, self)
+
+class Sugar:
+    """
+    Read-only view of a single cell of a SugarField, 
+    used for the portrayal of the sugar in the server.
+    """
+    def __init__(self, pos, field):
+        self.pos = pos
+        self.field = field
+
+    @property
+    def amount(self):
+        return self.field.amount[self.pos]
+
+    @property
+    def max_sugar(self):
+        return self.field.max_sugar[self.pos]
+
+    @property
+    def steps_since_crime(self):
+        return self.field.steps_since_crime[self.pos]
 
 class Cop(Agent):
     def __init__(
         self, pos, model, catch_radius=1, jail_sentence=10, 
-        id = np.random.random(), cop_stays_in_district=0, 
+        id=None, cop_stays_in_district=0, 
         surveillance_radius=1
     ):
         super().__init__(pos, model)
         self.pos = pos
         self.catch_radius = catch_radius
         self.jail_sentence = jail_sentence
-        self.id = id
+        self.id = self.random.random() if id is None else id
         self.cop_stays_in_district = cop_stays_in_district
         self.surveillance_radius = surveillance_radius
 
+    @property
+    def random(self):
+        """
+        Returns the random number generator of the cops.
+        """
+        return self.model.random_streams['Cop']
+
     def new_cop(self):
         """
         Places a new cop on the grid.
@@ -255,94 +250,17 @@ class Cop(Agent):
         self.model.remove_agent(self)
         self.model.n_cops -= 1 
 
-    def distribute_cops(self, crime_rates, current_distr):
-        """
-        This functions tells the step function 
-        how many cops have to switch city parts
-        assume crite_rates is a dictionary 
-        with the number of crimes per city part, 
-        eg: dict = {'zuid': 42, 'oost': 32, 'noord': 50, 'west': 1000}.
-        """
-
-        if np.sum([i for i in crime_rates.values()]) > 0:
-            total_crime = np.sum([i for i in crime_rates.values()])
-            nd_unrounded = {
-                key: self.model.n_cops * value / total_crime 
-                for key, value in crime_rates.items()
-            }
-            nd_decimals = {
-                key: value - math.floor(value) 
-                for key, value in nd_unrounded.items()
-            }
-
-            cops_left = (
-                self.model.n_cops 
-                - np.sum([math.floor(i) for i in nd_unrounded.values()])
-            )
-            new_distribution = {}
-            while cops_left > 0:
-                for key, value in nd_unrounded.items():
-                    if (
-                        nd_decimals[key] - math.floor(nd_decimals[key]) 
-                        == max(nd_decimals.values())
-                    ):
-                        new_distribution[key] = math.ceil(nd_unrounded[key])
-                        nd_decimals[key] = 0
-                        cops_left -= 1
-            for key in nd_decimals.keys():
-                new_distribution[key] = math.floor(nd_unrounded[key])
-
-            return {
-                key: value - current_distr[key] 
-                for key, value in new_distribution.items()
-            }
-        else:
-            return current_distr
-
     def step(self):
         """
-        When the first cop each step is asked to move, 
-        calculate the the distribution 
-        causes tango
+        Moves the cop to another district if its district has a surplus
+        of cops (see SugarscapeCg.redistribute_cops), 
+        and towards crime otherwise.
         """
   
         current_district = self.model.get_district(self.pos)
         self.surveillance_radius = (
             self.model.surveillance_levels[current_district]
         )
-        if self.model.cops_that_stepped == 0:
-            self.model.distribution_changes = self.distribute_cops(
-                self.model.get_crimes_per_district(), 
-                self.model.get_agents_per_district(Cop)
-            )
-            self.model.made_changes = {
-                'Centrum': 0, 
-                'Nieuw-West': 0, 
-                'Noord': 0, 
-                'Oost': 0, 
-                'West': 0, 
-                'Westpoort': 0, 
-                'Zuid': 0, 
-                'Zuidoost': 0, 
-                'Undefined': 0
-            }
-            self.model.districts_in_deficit = []
-            self.model.districts_in_surplus = []
-            for district, balance in self.model.distribution_changes.items():
-                if balance > 0:
-                    self.model.districts_in_deficit.append(district)
-                elif balance < 0:
-                    self.model.districts_in_surplus.append(district)
-            self.model.cops_that_stepped += 1
-            if self.model.n_cops == 1:
-                self.model.cops_that_stepped = 0        
-        
-        else:
-            self.model.cops_that_stepped += 1
-            # set up cops_that_stepped for the next step period
-            if self.model.cops_that_stepped == self.model.n_cops:
-                self.model.cops_that_stepped = 0
-
         if self.cop_stays_in_district == 0:
             if self.model.distribution_changes != self.model.made_changes:
                 district = self.model.get_district(self.pos)
@@ -374,32 +292,18 @@ class Cop(Agent):
         """
         Moves the cop towards a new district if there is a deficit of cops.
         """
-        centers = {
-            'Centrum': (32, 30), 
-            'Nieuw-West': (9, 14), 
-            'Noord': (31, 43), 
-            'Oost': (40, 18), 
-            'West': (23, 27), 
-            'Westpoort': (12, 33), 
-            'Zuid': (25, 11), 
-            'Zuidoost': (45, 14)
-        }
+        # the centers are derived from the map by the model
+        centers = self.model.district_centers
         distance_to_districts = {
-            'Centrum': get_distance(self.pos, (32, 30)), 
-            'Nieuw-West': get_distance(self.pos, (9, 14)), 
-            'Noord': get_distance(self.pos, (31, 43)), 
-            'Oost': get_distance(self.pos, (40, 18)), 
-            'West': get_distance(self.pos, (23, 27)), 
-            'Westpoort': get_distance(self.pos, (12, 33)), 
-            'Zuid': get_distance(self.pos, (25, 11)), 
-            'Zuidoost': get_distance(self.pos, (45, 14))
+            district: get_distance(self.pos, center)
+            for district, center in centers.items()
         }
 
         options = {}
         for key, value in distance_to_districts.items():
             if key in self.model.districts_in_deficit:
                 options[key] = value
-        min = 100 
+        min = math.inf
         new_district = ''
         for key, value in options.items():
             if value < min:
@@ -442,7 +346,7 @@ class Cop(Agent):
                 != self.model.get_district(self.pos)
             ):
                 del possible_moves[index]
-        new_pos = random.choice(possible_moves)
+        new_pos = self.random.choice(possible_moves)
         self.model.grid.move_agent(self, new_pos)
         self.catch_criminal(self.catch_radius)        
     
@@ -450,123 +354,24 @@ class Cop(Agent):
         """
         get moves in a large radius, 
         delete those outside district, select the one with the lowest sugar
-        """
-
-        possible_moves = self.model.grid.get_neighborhood(
-            self.pos, 
-            moore=True,
-            include_center=False, 
-            radius=self.surveillance_radius
+        and step towards it (see kernels.py)
+        """
+        x, y = self.pos
+        district_map = self.model.district_map
+        targets = kernels.min_sugar_cells(
+            district_map, 
+            self.model.sugar.amount, 
+            x, 
+            y, 
+            int(self.surveillance_radius)
         )
-        possible_moves_dict = {}
-        sugar_per_move = []
-        feasible_moves = []
-        for index, move in enumerate(possible_moves):
-            if (
-                self.model.get_district(move) 
-                == self.model.get_district(self.pos)
-            ):
-                feasible_moves.append(move)
-                sugar_per_move.append(self.get_sugar(move))
-
-        min_sugar_indices = np.where(
-            sugar_per_move == np.min(sugar_per_move)
-        )[0]
         # changed this so that within the region it 
         # moves towards any of the low sugar areas
-        direction = feasible_moves[random.choice(min_sugar_indices)]
-        if (
-            self.model.get_district(direction) 
-            != self.model.get_district(self.pos)
-        ):
-            print("gaat hier al fout : ", direction)
-
-        if self.pos[0] > direction[0]:
-            if self.pos[0] - 2 >= 0:
-                x_new = self.pos[0] - 2
-            else:
-                x_new = self.pos[0] - 1
-        elif self.pos[0] < direction[0]:
-            if self.pos[0] + 2 < 50:
-                x_new = self.pos[0] + 2
-            else:
-                x_new = self.pos[0] + 1
-        else:
-            x_new = self.pos[0]
-        if self.pos[1] > direction[1]:
-            if self.pos[1] - 2 >= 0:
-                y_new = self.pos[1] - 2
-            else:
-                y_new = self.pos[1] - 1
-        elif self.pos[1] < direction[1]:
-            if self.pos[1] + 2 < 50:
-                y_new = self.pos[1] + 2
-            else:
-                y_new = self.pos[1] + 1
-        else:
-            y_new = self.pos[1]
-
-        new_pos = (x_new, y_new)
-
-
-        if (
-            self.model.get_district(new_pos) 
-            != self.model.get_district(self.pos)
-        ):
-            if (
-                (self.pos[0] - 1 >= 0 and self.pos[1] - 1 >= 0) 
-                and (self.pos[0] + 1 <= 49 and self.pos[1] + 1 <= 49)
-            ):
-                if (
-                    (
-                        self.model.get_district((self.pos[0], self.pos[1] - 1)) 
-                        != self.model.get_district(self.pos)
-                    ) 
-                    and 
-                    (
-                        self.model.get_district((self.pos[0], self.pos[1] - 1)) 
-                        == self.model.get_district(new_pos)
-                    )
-                ): # new district is below current district
-                    y_new = self.pos[1]
-                elif (
-                    (
-                        self.model.get_district((self.pos[0], self.pos[1] + 1)) 
-                        != self.model.get_district(self.pos)
-                    ) 
-                    and 
-                    (
-                        self.model.get_district((self.pos[0], self.pos[1] + 1)) 
-                        == self.model.get_district(new_pos)
-                    )
-                ): # new district is above current district
-                    y_new = self.pos[1]
-                elif (
-                    (
-                        self.model.get_district((self.pos[0] - 1, self.pos[1])) 
-                        != self.model.get_district(self.pos)
-                    ) 
-                    and 
-                    (
-                        self.model.get_district((self.pos[0] - 1, self.pos[1])) 
-                        == self.model.get_district(new_pos)
-                    )
-                ): # new district is to the left of the current district
-                    x_new = self.pos[0]
-                elif (
-                    (
-                        self.model.get_district((self.pos[0] + 1, self.pos[1])) 
-                        != self.model.get_district(self.pos)
-                    ) 
-                    and 
-                    (
-                        self.model.get_district((self.pos[0] + 1, self.pos[1])) 
-                        == self.model.get_district(new_pos)
-                    )
-                ): # new district is to the right of the current district
-                    x_new = self.pos[0]
-
-                new_pos = (x_new, y_new)
+        direction = targets[self.random.randrange(len(targets))]
+        x_new, y_new = kernels.step_towards_crime(
+            district_map, x, y, int(direction[0]), int(direction[1])
+        )
+        new_pos = (int(x_new), int(y_new))
 
         if(self.police_here(new_pos)):
             self.random_cop_move()
@@ -578,40 +383,55 @@ class Cop(Agent):
         """
         Return a bool indication the presense of police on a cell.
         """
-        this_cell = self.model.grid.get_cell_list_contents([pos])
-        for agent in this_cell:
-            if type(agent) is Cop:
-                return True
-        return False
+        return self.model.grid.occupancy[Cop][pos] > 0
         
     def get_sugar(self, pos):
         """
         Return the amount of sugar on a cell.
         """
-        this_cell = self.model.grid.get_cell_list_contents([pos])
-        for agent in this_cell:
-            if type(agent) is Sugar:
-                return int(agent.amount)    
+        return int(self.model.sugar.amount[pos])
 
     def catch_criminal(self, catch_radius):
         """
         Catch a criminal if it is within reach 
         and has comitted a crime in the current step.
+
+        A criminal is chosen among all criminals within reach, in the order
+        of the grid's neighbors, and only caught if it did a crime. The
+        occupancy layers are used to count them and to find the chosen one,
+        so only the cell of the chosen criminal is looked at.
         """
-        neighbors = self.model.grid.get_neighbors(
-            self.pos, 
-            moore=True, 
-            include_center=True, 
-            radius=catch_radius
+        grid = self.model.grid
+        criminals, x_min, y_min = grid.get_window(
+            grid.occupancy[Criminal], self.pos, catch_radius
+        )
+        n_criminals = criminals.sum()
+        if n_criminals == 0:
+            return
+        index = self.random.randrange(int(n_criminals))
+        crimes, _, _ = grid.get_window(
+            self.model.crime_occupancy, self.pos, catch_radius
         )
-        catchable_criminals = [
-            obj for obj in neighbors if isinstance(obj, Criminal)
-        ]
-        if len(catchable_criminals) > 0:
-            criminal_to_catch = self.random.choice(catchable_criminals)         
-            #if not yet in jail
-            if(criminal_to_catch.jail_time==0 and criminal_to_catch.does_crime):
-                criminal_to_catch.wealth -= self.get_sugar(
-                    criminal_to_catch.pos
-                )
-                criminal_to_catch.jail_time += self.jail_sentence
\ No newline at end of file
+        if not crimes.any():
+            # nobody within reach can be caught
+            return
+
+        # find the cell of the chosen criminal
+        counts = criminals.ravel()
+        cell = np.searchsorted(np.cumsum(counts), index, side='right')
+        index -= counts[:cell].sum()
+        x, y = np.unravel_index(cell, criminals.shape)
+        pos = (x_min + int(x), y_min + int(y))
+        criminal_to_catch = [
+            obj for obj in grid.get_cell_list_contents([pos]) 
+            if isinstance(obj, Criminal)
+        ][index]
+
+        #if not yet in jail
+        if(criminal_to_catch.jail_time==0 and criminal_to_catch.does_crime):
+            criminal_to_catch.wealth -= self.get_sugar(
+                criminal_to_catch.pos
+            )
+            criminal_to_catch.jail_time += self.jail_sentence
+            if criminal_to_catch.jail_time > 0:
+                self.model.crime_occupancy[criminal_to_catch.pos] -= 1
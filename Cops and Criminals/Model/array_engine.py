@@ -0,0 +1,853 @@
+"""
+Struct-of-arrays engine of SugarscapeCg.
+
+SugarscapeCg(engine='arrays') runs the model on NumPy arrays instead of
+Criminal and Cop objects on a MultiGrid. The state of the criminals
+(position, wealth, risk aversion, jail time, buddy id, crime flag and
+crime count) and of the cops (position and the steps they stay in their
+district) are (replicate, agent) arrays, and every phase of a step is a
+kernel over the whole population:
+
+    sugar regrowth    SugarField.step on (replicate, x, y) arrays
+    risk field        the cop occupancy convolved with the risk kernel
+    criminals         Criminal.step
+    redistribution    SugarscapeCg.redistribute_cops
+    cops              Cop.step, with move_to_crime, random_cop_move,
+                      new_district_move and catch_criminal
+
+In the object model the agents of a breed act one after another in a
+random order, and so they do here: the criminals take their turns in
+kernels.criminal_turns, or rank by rank across the replicates without
+the compiled kernels, and the cops move rank by rank, checking for
+police on the cell they head for at that moment. Only the catching is
+resolved at once: a criminal caught by two cops is caught by the first.
+
+The engine also keeps two quirks of the object model that shape its
+outputs. Agents are identified by their start cell, so of the agents of
+a breed that start on the same cell only the last one is scheduled, and
+the others stay on the grid without acting. Cop.random_cop_move deletes
+cells from the neighborhood list that the grid caches, so those lists
+shrink over a run (neighborhoods).
+
+The engine is therefore equal to the object model in distribution, not
+draw for draw; see equivalence.py for the check, which can run across
+the bounds of the sensitivity analysis.
+
+Every replicate draws from its own generator, in the same order whether
+it runs alone or stacked with others, so a replicate gives the same run
+for the same seed in both cases.
+"""
+
+import numpy as np
+
+from agents import SugarField
+import kernels
+
+# columns of the initial criminal state passed to ArrayEngine
+criminal_fields = ['x', 'y', 'wealth', 'risk_aversion', 'buddy_id']
+
+
+class ArrayEngine:
+    """
+    The criminals and cops of one or more replicates of a model as arrays.
+
+    The configuration (map, districts, radii, sentence) is read from the
+    model, which is the same for all replicates.
+    """
+
+    def __init__(self, model, criminals, cops, seeds):
+        """
+        Args:
+            model: SugarscapeCg that holds the configuration
+            criminals: (replicate, criminal, field) array of the initial
+                state of the criminals, with the fields criminal_fields
+            cops: (replicate, cop, 2) array of the initial cop positions
+            seeds: entropy of the generator of every replicate
+        """
+        self.model = model
+        criminals = np.asarray(criminals, dtype=float).reshape(
+            len(seeds), -1, len(criminal_fields)
+        )
+        cops = np.asarray(cops, dtype=int).reshape(len(seeds), -1, 2)
+        self.replicates, self.n_criminals = criminals.shape[:2]
+        self.n_cops = cops.shape[1]
+        self.width = model.width
+        self.height = model.height
+        self.cells = self.width * self.height
+
+        # criminals
+        self.criminal_x = criminals[:, :, 0].astype(int)
+        self.criminal_y = criminals[:, :, 1].astype(int)
+        self.wealth = criminals[:, :, 2].copy()
+        self.risk_aversion = criminals[:, :, 3].astype(int)
+        self.buddy_id = criminals[:, :, 4].astype(int)
+        self.jail_time = np.zeros(self.criminal_x.shape, dtype=int)
+        self.does_crime = np.zeros(self.criminal_x.shape, dtype=bool)
+        self.crimes_commited = np.zeros(self.criminal_x.shape, dtype=int)
+        self.n_groups = self.buddy_id.max(initial=0) + 1
+
+        # cops
+        self.cop_x = cops[:, :, 0].copy()
+        self.cop_y = cops[:, :, 1].copy()
+        self.cop_stays_in_district = np.zeros(self.cop_x.shape, dtype=int)
+
+        # the agents of the object model are identified by their start
+        # cell, so of the agents of a breed that start on the same cell
+        # only the last one is scheduled; the others stay on the grid, in
+        # their buddy group and in the counts of the cops, but never act.
+        # The schedule totals leave out the criminals whose id is also
+        # taken by a cop.
+        self.criminal_scheduled = self.last_on_cell(
+            self.criminal_x, self.criminal_y
+        )
+        self.cop_scheduled = self.last_on_cell(self.cop_x, self.cop_y)
+        self.criminal_listed = self.criminal_scheduled & (
+            self.get_occupancy(self.cop_x, self.cop_y)[
+                np.arange(self.replicates)[:, None],
+                self.criminal_x,
+                self.criminal_y
+            ] == 0
+        )
+
+        # the field and the counters of every replicate
+        self.sugar = SugarField(model.initial_wealth_distribution)
+        self.sugar.amount = np.repeat(
+            self.sugar.amount[None], self.replicates, axis=0
+        )
+        self.sugar.steps_since_crime = np.repeat(
+            self.sugar.steps_since_crime[None], self.replicates, axis=0
+        )
+        n_districts = len(model.district_names)
+        self.crimes_per_district_step = np.zeros(
+            (self.replicates, n_districts), dtype=int
+        )
+        self.crimes_per_district_cumulative = np.zeros(
+            (self.replicates, n_districts), dtype=int
+        )
+        self.average_crimes_per_district = np.zeros(
+            (self.replicates, n_districts)
+        )
+        self.crime_occupancy = np.zeros(
+            (self.replicates, self.width, self.height), dtype=int
+        )
+
+        # district centers as arrays, by district id
+        self.center_x = np.zeros(n_districts, dtype=int)
+        self.center_y = np.zeros(n_districts, dtype=int)
+        self.has_center = np.zeros(n_districts, dtype=bool)
+        for district, (x, y) in model.district_centers.items():
+            district_id = model.district_ids[district]
+            self.center_x[district_id] = x
+            self.center_y[district_id] = y
+            self.has_center[district_id] = True
+
+        self.reseed(seeds)
+        self.reset_neighborhoods()
+        self.update_risk_field()
+
+    def last_on_cell(self, x, y):
+        """
+        Returns the (replicate, agent) mask of the agents that are the
+        last one of their breed on their start cell.
+        """
+        flat = (
+            np.arange(self.replicates)[:, None] * self.cells
+            + x * self.height + y
+        ).ravel()
+        _, reversed_index = np.unique(flat[::-1], return_index=True)
+        last = np.zeros(len(flat), dtype=bool)
+        last[len(flat) - 1 - reversed_index] = True
+        return last.reshape(x.shape)
+
+    def reset_neighborhoods(self):
+        """
+        Restores the neighborhood of every cell that Cop.random_cop_move
+        draws from to all its neighbors inside the grid.
+
+        The object model deletes cells from the neighborhood list that
+        the grid caches, so the list of a cell gets shorter every time a
+        cop makes a random move from it, until the cache is cleared.
+        neighborhoods is the (replicate, cell, neighbor) mask of the
+        cells that are left, with the neighbors in the order of the grid.
+        """
+        dx, dy = self.get_neighbor_offsets()
+        x = np.arange(self.cells)[:, None] // self.height + dx
+        y = np.arange(self.cells)[:, None] % self.height + dy
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        self.neighborhoods = np.repeat(inside[None], self.replicates, axis=0)
+
+    def get_neighbor_offsets(self):
+        """
+        Returns the (dx, dy) offsets of the eight neighbors of a cell,
+        in the order of the grid.
+        """
+        dx, dy = self.model.get_window_offsets(1)
+        center = (dx == 0) & (dy == 0)
+        return dx[~center], dy[~center]
+
+    def reseed(self, seeds):
+        """
+        Gives every replicate a new generator.
+        """
+        self.generators = [np.random.default_rng(seed) for seed in seeds]
+
+    @classmethod
+    def stack(cls, engines):
+        """
+        Returns the replicates of several engines of the same
+        configuration as a single engine.
+        """
+        engine = cls.__new__(cls)
+        engine.__dict__.update(engines[0].__dict__)
+        engine.sugar = SugarField(engines[0].model.initial_wealth_distribution)
+        for name in [
+            'criminal_x', 'criminal_y', 'wealth', 'risk_aversion',
+            'buddy_id', 'jail_time', 'does_crime', 'crimes_commited',
+            'cop_x', 'cop_y', 'cop_stays_in_district',
+            'criminal_scheduled', 'criminal_listed', 'cop_scheduled',
+            'neighborhoods',
+            'crimes_per_district_step', 'crimes_per_district_cumulative',
+            'average_crimes_per_district', 'crime_occupancy', 'risk_field'
+        ]:
+            setattr(engine, name, np.concatenate(
+                [getattr(other, name) for other in engines]
+            ))
+        engine.sugar.amount = np.concatenate(
+            [other.sugar.amount for other in engines]
+        )
+        engine.sugar.steps_since_crime = np.concatenate(
+            [other.sugar.steps_since_crime for other in engines]
+        )
+        engine.replicates = len(engine.criminal_x)
+        engine.n_groups = max(other.n_groups for other in engines)
+        engine.generators = [
+            generator for other in engines for generator in other.generators
+        ]
+        return engine
+
+    def uniform(self, replicates):
+        """
+        Returns a uniform draw for every entry of a sorted array of
+        replicate indices, each from the generator of its replicate.
+        """
+        counts = np.bincount(replicates, minlength=self.replicates)
+        if self.replicates == 1:
+            return self.generators[0].random(counts[0])
+        return np.concatenate([
+            generator.random(count)
+            for generator, count in zip(self.generators, counts)
+        ])
+
+    def step(self):
+        """
+        Advances all replicates one step.
+        """
+        self.crimes_per_district_step[:] = 0
+        self.crime_occupancy[:] = 0
+        self.sugar.step()
+        self.update_risk_field()
+        self.step_criminals()
+        surplus, deficit = self.redistribute_cops()
+        self.step_cops(surplus, deficit)
+
+    def update_risk_field(self):
+        """
+        Computes the risk of every cell like SugarscapeCg.update_risk_field.
+
+        Only the cells around the cops are visited: the weights of the
+        occupied cells are added window offset by window offset, in the
+        order of SugarscapeCg.update_risk_field, so every cell sums the
+        same terms in the same order.
+        """
+        occupancy = self.get_occupancy(self.cop_x, self.cop_y)
+        kernel = self.model.risk_kernel
+        radius = len(kernel) // 2
+        replicate, x, y = np.nonzero(occupancy)
+        i, j = np.nonzero(kernel)
+        target_x = x - (i[:, None] - radius)
+        target_y = y - (j[:, None] - radius)
+        inside = (
+            (target_x >= 0) & (target_x < self.width)
+            & (target_y >= 0) & (target_y < self.height)
+        )
+        weights = kernel[i, j][:, None] * occupancy[replicate, x, y]
+        risk_field = np.zeros(occupancy.shape)
+        np.add.at(
+            risk_field,
+            (
+                np.broadcast_to(replicate, inside.shape)[inside],
+                target_x[inside],
+                target_y[inside]
+            ),
+            weights[inside]
+        )
+        risk_field[occupancy > 0] = 100
+        self.risk_field = risk_field
+
+    def get_occupancy(self, x, y, weights=None):
+        """
+        Returns the (replicate, x, y) count of the agents at (x, y),
+        or the sum of their weights.
+        """
+        replicates = np.repeat(np.arange(self.replicates), x.shape[1])
+        flat = (replicates * self.width + x.ravel()) * self.height + y.ravel()
+        occupancy = np.bincount(
+            flat,
+            weights=None if weights is None else weights.ravel(),
+            minlength=self.replicates * self.cells
+        )
+        return occupancy.reshape(self.replicates, self.width, self.height)
+
+    def get_window_counts(self, layer, replicate, x, y, radius):
+        """
+        Returns the sum of a (replicate, x, y) layer in the windows of
+        radius around the positions, clipped to the grid.
+        """
+        table = np.zeros(
+            (self.replicates, self.width + 1, self.height + 1),
+            dtype=layer.dtype
+        )
+        table[:, 1:, 1:] = layer.cumsum(axis=1).cumsum(axis=2)
+        x_min = np.maximum(x - radius, 0)
+        y_min = np.maximum(y - radius, 0)
+        x_max = np.minimum(x + radius + 1, self.width)
+        y_max = np.minimum(y + radius + 1, self.height)
+        return (
+            table[replicate, x_max, y_max]
+            - table[replicate, x_min, y_max]
+            - table[replicate, x_max, y_min]
+            + table[replicate, x_min, y_min]
+        )
+
+    def get_buddy_groups(self):
+        """
+        Returns the group of every criminal (flat indices) and the
+        criminals sorted by group, with the start and count of every
+        group of every replicate.
+        """
+        groups = (
+            np.arange(self.replicates)[:, None] * self.n_groups
+            + self.buddy_id
+        ).ravel()
+        counts = np.bincount(
+            groups, minlength=self.replicates * self.n_groups
+        )
+        return (
+            groups,
+            np.argsort(groups, kind='stable'),
+            np.cumsum(counts) - counts,
+            counts
+        )
+
+    def get_candidate_cells(self, criminals, buddy_groups, radius):
+        """
+        Returns the cells the given criminals can reach: the union of the
+        neighborhoods of the members of their buddy group at their current
+        positions, which is the set of candidate cells of Criminal.step.
+        The cells are sorted by criminal, with the start and count of
+        every criminal.
+        """
+        groups, members, starts, counts = buddy_groups
+        groups = groups[criminals]
+        counts = counts[groups]
+        segment_starts = np.cumsum(counts) - counts
+        owner = np.repeat(np.arange(len(criminals)), counts)
+        buddies = members[
+            np.repeat(starts[groups] - segment_starts, counts)
+            + np.arange(counts.sum())
+        ]
+
+        dx, dy = self.model.get_window_offsets(radius)
+        x = self.criminal_x.ravel()[buddies][:, None] + dx
+        y = self.criminal_y.ravel()[buddies][:, None] + dy
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        candidates = np.zeros((len(criminals), self.cells), dtype=bool)
+        candidates[
+            np.broadcast_to(owner[:, None], x.shape)[inside],
+            (x * self.height + y)[inside]
+        ] = True
+        counts = np.count_nonzero(candidates, axis=1)
+        return (
+            np.flatnonzero(candidates) % self.cells,
+            np.cumsum(counts) - counts,
+            counts
+        )
+
+    def choose_targets(self, criminals, picks, candidate_cells, a=1, c=0.3):
+        """
+        Evaluates the utility of Criminal.get_utility on the candidate
+        cells of the criminals (sorted flat indices) and chooses one of the
+        cells with the highest utility for each of them, the one at picks
+        of the way through them.
+
+        Returns the chosen cells and the highest utilities.
+        """
+        cells, segment_starts, counts = candidate_cells
+        segment = np.repeat(np.arange(len(criminals)), counts)
+        owner = criminals[segment]
+        replicate = owner // self.n_criminals
+        x, y = cells // self.height, cells % self.height
+
+        wealth = self.sugar.amount[replicate, x, y]
+        risk = self.risk_field[replicate, x, y]
+        distance = np.sqrt(
+            (x - self.criminal_x.ravel()[owner]) ** 2
+            + (y - self.criminal_y.ravel()[owner]) ** 2
+        )
+        distance[distance < 2] = 0
+        district_risk = self.model.surveillance_map[x, y]
+        own_wealth = self.wealth.ravel()[owner]
+        # if your own wealth is negative you're more likely to commit crimes
+        d = np.where(own_wealth < 0, 0.5, 0.01)
+        utility = (
+            + a * wealth
+            - self.risk_aversion.ravel()[owner] * district_risk * risk
+            - c * distance
+            - d * own_wealth
+        )
+
+        # a random cell among the ones with the highest utility
+        highest = np.maximum.reduceat(utility, segment_starts)
+        best = np.flatnonzero(utility == highest[segment])
+        counts = np.bincount(segment[best], minlength=len(criminals))
+        chosen = best[
+            np.cumsum(counts) - counts + (picks * counts).astype(int)
+        ]
+        return cells[chosen], highest
+
+    def step_criminals(self, search_radius=1):
+        """
+        Criminal.step for all criminals: the criminals in jail serve their
+        time, the others move to a cell with the highest utility, or
+        towards it if it is in the neighborhood of a buddy, and rob it.
+
+        The criminals act one after another in the order of their
+        priority, as the schedule of the object model does, so every
+        criminal sees the cells robbed and the buddies moved before it.
+        This runs in kernels.criminal_turns if the kernels are compiled,
+        and in take_turns otherwise, with the same results.
+        """
+        n = self.n_criminals
+        self.does_crime[:] = False
+        jailed = self.jail_time > 0
+        self.jail_time[jailed] -= 1
+        active = np.flatnonzero((~jailed & self.criminal_scheduled).ravel())
+        priority = self.uniform(np.repeat(np.arange(self.replicates), n))
+        active = active[np.lexsort((priority[active], active // n))]
+        picks = self.uniform(active // n)
+        buddy_groups = self.get_buddy_groups()
+
+        if kernels.compiled:
+            robbed = kernels.criminal_turns(
+                active, picks,
+                self.criminal_x.ravel(), self.criminal_y.ravel(),
+                self.wealth.ravel(), self.risk_aversion.ravel(),
+                *buddy_groups,
+                self.sugar.amount, self.sugar.steps_since_crime,
+                self.risk_field, self.model.surveillance_map, search_radius
+            )
+        else:
+            robbed = self.take_turns(
+                active, picks, buddy_groups, search_radius
+            )
+
+        # count the crimes
+        thieves = active[robbed >= 0]
+        replicate = thieves // n
+        crime_x = robbed[robbed >= 0] // self.height
+        crime_y = robbed[robbed >= 0] % self.height
+        self.crimes_commited.ravel()[thieves] += 1
+        self.does_crime.ravel()[thieves] = True
+        districts = self.model.district_map[crime_x, crime_y]
+        np.add.at(self.crimes_per_district_step, (replicate, districts), 1)
+        np.add.at(
+            self.crimes_per_district_cumulative, (replicate, districts), 1
+        )
+        np.add.at(self.crime_occupancy, (replicate, crime_x, crime_y), 1)
+
+        #daily expenses
+        self.wealth.ravel()[active] -= 20
+
+    def take_turns(self, order, picks, buddy_groups, search_radius):
+        """
+        kernels.criminal_turns as array operations: the k-th criminal
+        of every replicate acts at once, for k = 0, 1, ...
+
+        Returns the flat index of the cell every criminal robbed, or -1.
+        """
+        n = self.n_criminals
+        x, y = self.criminal_x.ravel(), self.criminal_y.ravel()
+        wealth = self.wealth.ravel()
+        amount = self.sugar.amount
+        robbed = np.full(len(order), -1)
+
+        counts = np.bincount(order // n, minlength=self.replicates)
+        rank = np.arange(len(order)) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        for k in range(counts.max(initial=0)):
+            turns = np.flatnonzero(rank == k)
+            criminals = order[turns]
+            cells, highest = self.choose_targets(
+                criminals,
+                picks[turns],
+                self.get_candidate_cells(
+                    criminals, buddy_groups, search_radius
+                )
+            )
+            replicate = criminals // n
+            target_x, target_y = cells // self.height, cells % self.height
+            buddy_move = (
+                (np.abs(target_x - x[criminals]) > search_radius)
+                | (np.abs(target_y - y[criminals]) > search_radius)
+            )
+            robs = (
+                ~buddy_move
+                & (amount[replicate, target_x, target_y] > 0)
+                & (highest > 0)
+            )
+
+            # move, one step towards the buddy for a buddy move
+            x[criminals] = np.where(
+                buddy_move,
+                x[criminals] + np.sign(target_x - x[criminals]),
+                target_x
+            )
+            y[criminals] = np.where(
+                buddy_move,
+                y[criminals] + np.sign(target_y - y[criminals]),
+                target_y
+            )
+
+            # do the crime
+            thieves = criminals[robs]
+            replicate = replicate[robs]
+            crime_x, crime_y = target_x[robs], target_y[robs]
+            wealth[thieves] += amount[replicate, crime_x, crime_y]
+            amount[replicate, crime_x, crime_y] = 0
+            self.sugar.steps_since_crime[replicate, crime_x, crime_y] = 2
+            robbed[turns[robs]] = cells[robs]
+        return robbed
+
+    def redistribute_cops(self):
+        """
+        SugarscapeCg.redistribute_cops for all replicates.
+
+        Returns the (replicate, district) masks of the districts
+        in surplus and in deficit.
+        """
+        model = self.model
+        n_districts = len(model.district_names)
+        districts = model.district_map[self.cop_x, self.cop_y]
+        cops = np.zeros((self.replicates, n_districts), dtype=int)
+        np.add.at(
+            cops,
+            (np.arange(self.replicates)[:, None], districts),
+            1
+        )
+        order = model.district_order_ids
+        changes = np.zeros((self.replicates, n_districts), dtype=int)
+        changes[:, order] = model.distribute_cops(
+            self.crimes_per_district_step[:, order], cops[:, order]
+        )
+        return changes < 0, changes > 0
+
+    def step_cops(self, surplus, deficit):
+        """
+        Cop.step for all cops: cops with a surplus in their district move
+        towards the nearest district with a deficit, the others move
+        towards crime, and all try to catch a criminal.
+        """
+        model = self.model
+        replicate = np.repeat(np.arange(self.replicates), self.n_cops)
+        x, y = self.cop_x.ravel(), self.cop_y.ravel()
+        stays = self.cop_stays_in_district.ravel()
+        district = model.district_map[x, y]
+        priority = self.uniform(replicate)
+        scheduled = self.cop_scheduled.ravel()
+
+        # new_district_move
+        options = deficit[replicate] & self.has_center
+        distance = np.where(
+            options,
+            np.hypot(
+                x[:, None] - self.center_x, y[:, None] - self.center_y
+            ),
+            np.inf
+        )
+        target = np.argmin(distance, axis=1)
+        new_x = x + np.sign(self.center_x[target] - x)
+        new_y = y + np.sign(self.center_y[target] - y)
+        district_move = (
+            scheduled
+            & (stays == 0)
+            & surplus[replicate, district]
+            & options.any(axis=1)
+            & (model.district_map[new_x, new_y] != model.undefined_id)
+        )
+
+        to_crime = np.flatnonzero(scheduled & ~district_move)
+        crime_x, crime_y = self.move_to_crime(
+            replicate[to_crime], x[to_crime], y[to_crime], district[to_crime]
+        )
+        new_x[to_crime] = crime_x
+        new_y[to_crime] = crime_y
+        new_x, new_y = self.resolve_cop_moves(
+            replicate, x, y, district, new_x, new_y, to_crime, priority
+        )
+        catch_radius = np.where(district_move, 1, model.cop_catch_radius)
+
+        x[:] = new_x
+        y[:] = new_y
+        stays[scheduled & (stays > 0)] -= 1
+        stays[model.district_map[x, y] != district] = 5
+        moved = np.flatnonzero(scheduled)
+        self.catch_criminals(
+            replicate[moved], x[moved], y[moved],
+            catch_radius[moved], priority[moved]
+        )
+
+    def resolve_cop_moves(
+        self, replicate, x, y, district, new_x, new_y, to_crime, priority
+    ):
+        """
+        Moves the scheduled cops one after another in the order of their
+        priority, as the schedule of the object model does. A cop moving
+        towards crime makes a random move instead if its cell holds a cop
+        at that moment: one that moved there, one that has not moved
+        away yet, or one that never moves.
+
+        Returns the new positions, which are the old ones for the cops
+        that are not scheduled.
+        """
+        police = self.get_occupancy(self.cop_x, self.cop_y).reshape(
+            self.replicates, -1
+        )
+        checked = np.zeros(len(x), dtype=bool)
+        checked[to_crime] = True
+        final_x, final_y = x.copy(), y.copy()
+
+        movers = np.flatnonzero(self.cop_scheduled.ravel())
+        movers = movers[np.lexsort((priority[movers], replicate[movers]))]
+        counts = np.bincount(replicate[movers], minlength=self.replicates)
+        rank = np.arange(len(movers)) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        # the k-th cop of every replicate at once
+        for k in range(counts.max(initial=0)):
+            cops = movers[rank == k]
+            cop_replicate = replicate[cops]
+            target_x, target_y = new_x[cops], new_y[cops]
+            taken = checked[cops] & (
+                police[cop_replicate, target_x * self.height + target_y] > 0
+            )
+            if taken.any():
+                random_moves = cops[taken]
+                target_x[taken], target_y[taken] = self.random_cop_move(
+                    replicate[random_moves], x[random_moves], y[random_moves],
+                    district[random_moves]
+                )
+            police[cop_replicate, x[cops] * self.height + y[cops]] -= 1
+            police[cop_replicate, target_x * self.height + target_y] += 1
+            final_x[cops] = target_x
+            final_y[cops] = target_y
+        return final_x, final_y
+
+    def move_to_crime(self, replicate, x, y, district):
+        """
+        Cop.move_to_crime for the given cops: a step of two towards a
+        cell with the least sugar in the surveillance radius and the own
+        district, corrected at district borders. Whether that cell is
+        taken by another cop is checked by resolve_cop_moves.
+
+        Returns the cells the cops move to.
+        """
+        model = self.model
+        radius = model.surveillance_map[x, y]
+        dx, dy = model.get_window_offsets(model.surveillance_map.max())
+        center = (dx == 0) & (dy == 0)
+        dx, dy = dx[~center], dy[~center]
+
+        window_x = x[:, None] + dx
+        window_y = y[:, None] + dy
+        feasible = (
+            (np.abs(dx) <= radius[:, None])
+            & (np.abs(dy) <= radius[:, None])
+            & (window_x >= 0) & (window_x < self.width)
+            & (window_y >= 0) & (window_y < self.height)
+        )
+        window_x = np.clip(window_x, 0, self.width - 1)
+        window_y = np.clip(window_y, 0, self.height - 1)
+        feasible &= model.district_map[window_x, window_y] == district[:, None]
+
+        # a random cell among the ones with the least sugar
+        sugar = np.where(
+            feasible,
+            np.floor(self.sugar.amount[replicate[:, None], window_x, window_y]),
+            np.inf
+        )
+        least = sugar == sugar.min(axis=1, keepdims=True)
+        keys = np.full(sugar.shape, -1.0)
+        keys[feasible & least] = self.uniform(
+            np.broadcast_to(replicate[:, None], sugar.shape)[feasible & least]
+        )
+        chosen = np.argmax(keys, axis=1)
+        rows = np.arange(len(x))
+        any_feasible = feasible.any(axis=1)
+        direction_x = np.where(any_feasible, window_x[rows, chosen], x)
+        direction_y = np.where(any_feasible, window_y[rows, chosen], y)
+
+        # steps of two, or one at the edge of the grid
+        new_x = np.where(
+            x > direction_x,
+            np.where(x - 2 >= 0, x - 2, x - 1),
+            np.where(
+                x < direction_x,
+                np.where(x + 2 < self.width, x + 2, x + 1),
+                x
+            )
+        )
+        new_y = np.where(
+            y > direction_y,
+            np.where(y - 2 >= 0, y - 2, y - 1),
+            np.where(
+                y < direction_y,
+                np.where(y + 2 < self.height, y + 2, y + 1),
+                y
+            )
+        )
+
+        # stay on the own axis when the step crosses a district border
+        new_district = model.district_map[new_x, new_y]
+        inner = (
+            (new_district != district)
+            & (x - 1 >= 0) & (y - 1 >= 0)
+            & (x + 1 < self.width) & (y + 1 < self.height)
+        )
+        x_in = np.clip(x, 1, self.width - 2)
+        y_in = np.clip(y, 1, self.height - 2)
+
+        def crosses(neighbor_x, neighbor_y):
+            neighbor = model.district_map[neighbor_x, neighbor_y]
+            return inner & (neighbor != district) & (neighbor == new_district)
+
+        vertical = crosses(x_in, y_in - 1) | crosses(x_in, y_in + 1)
+        horizontal = ~vertical & (
+            crosses(x_in - 1, y_in) | crosses(x_in + 1, y_in)
+        )
+        new_y = np.where(vertical, y, new_y)
+        new_x = np.where(horizontal, x, new_x)
+        return new_x, new_y
+
+    def random_cop_move(self, replicate, x, y, district):
+        """
+        Cop.random_cop_move for the given cops, one per replicate: a move
+        to a random cell of the neighborhood, from which the cells outside
+        the own district are deleted the way Cop.random_cop_move deletes
+        them. The deletions are kept, like in the cache of the grid.
+
+        Returns the new positions.
+        """
+        dx, dy = self.get_neighbor_offsets()
+        neighbor_x = x[:, None] + dx
+        neighbor_y = y[:, None] + dy
+        cell = x * self.height + y
+        kept = self.neighborhoods[replicate, cell]
+        outside_district = kept & (
+            self.model.district_map[
+                np.clip(neighbor_x, 0, self.width - 1),
+                np.clip(neighbor_y, 0, self.height - 1)
+            ]
+            != district[:, None]
+        )
+
+        # deleting while iterating skips the cell after a deleted one
+        looked_at = np.ones(len(x), dtype=bool)
+        for column in range(kept.shape[1]):
+            deleted = looked_at & outside_district[:, column]
+            kept[:, column] &= ~deleted
+            looked_at = np.where(kept[:, column] | deleted, ~deleted, looked_at)
+        self.neighborhoods[replicate, cell] = kept
+
+        keys = np.full(kept.shape, -1.0)
+        keys[kept] = self.uniform(
+            np.broadcast_to(replicate[:, None], kept.shape)[kept]
+        )
+        chosen = np.argmax(keys, axis=1)
+        rows = np.arange(len(x))
+        any_kept = kept.any(axis=1)
+        return (
+            np.where(any_kept, neighbor_x[rows, chosen], x),
+            np.where(any_kept, neighbor_y[rows, chosen], y)
+        )
+
+    def catch_criminals(self, replicate, x, y, catch_radius, priority):
+        """
+        Cop.catch_criminal for all cops: every cop picks a random criminal
+        within reach, which is caught if it did a crime this step.
+        """
+        n = self.n_criminals
+        criminals = self.get_occupancy(self.criminal_x, self.criminal_y)
+        in_reach = self.get_window_counts(
+            criminals, replicate, x, y, catch_radius
+        )
+        catchable = self.get_window_counts(
+            self.crime_occupancy, replicate, x, y, catch_radius
+        )
+        picks = self.uniform(replicate)
+        catching = np.flatnonzero(picks * in_reach < catchable)
+        if len(catching) == 0:
+            return
+
+        # the catchable criminal every catching cop picked
+        suspects = np.flatnonzero(
+            (self.does_crime & (self.jail_time == 0)).ravel()
+        )
+        counts = np.bincount(suspects // n, minlength=self.replicates)
+        starts = np.cumsum(counts) - counts
+        cop_counts = counts[replicate[catching]]
+        segment_starts = np.cumsum(cop_counts) - cop_counts
+        cop = np.repeat(catching, cop_counts)
+        suspect = suspects[
+            np.repeat(starts[replicate[catching]] - segment_starts, cop_counts)
+            + np.arange(cop_counts.sum())
+        ]
+        within = (
+            (np.abs(self.criminal_x.ravel()[suspect] - x[cop])
+             <= catch_radius[cop])
+            & (np.abs(self.criminal_y.ravel()[suspect] - y[cop])
+               <= catch_radius[cop])
+        )
+        cop, suspect = cop[within], suspect[within]
+        keys = self.uniform(replicate[cop])
+        order = np.lexsort((keys, cop))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = cop[order][1:] != cop[order][:-1]
+        cop, suspect = cop[order][last], suspect[order][last]
+
+        # a criminal caught by several cops is caught by the first
+        order = np.lexsort((priority[cop], suspect))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = suspect[order][1:] != suspect[order][:-1]
+        caught = suspect[order][first]
+
+        criminal_replicate = caught // n
+        self.wealth.ravel()[caught] -= np.floor(self.sugar.amount[
+            criminal_replicate,
+            self.criminal_x.ravel()[caught],
+            self.criminal_y.ravel()[caught]
+        ])
+        self.jail_time.ravel()[caught] += self.model.jail_sentence
+
+    def get_criminal_totals(self):
+        """
+        Returns the total wealth, the number of criminals, the number of
+        criminals in jail and the total number of crimes of every replicate.
+        """
+        listed = self.criminal_listed
+        return (
+            (self.wealth * listed).sum(axis=1),
+            self.criminal_scheduled.sum(axis=1),
+            ((self.jail_time > 0) & listed).sum(axis=1),
+            (self.crimes_commited * listed).sum(axis=1)
+        )
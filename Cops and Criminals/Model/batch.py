@@ -0,0 +1,166 @@
+"""
+Replicates of SugarscapeCg run as one batched simulation.
+
+The notebook experiments run the replicates of a configuration one after
+another. A ReplicateBatch sets up every replicate like
+SugarscapeCg(seed=seed, engine='arrays') and stacks their array engines,
+so the state of all replicates lives in arrays with a leading replicate
+axis and every step advances all of them with the same kernels. Every
+replicate keeps its own generator, so replicate r of a batch gives the
+same run as a single model with the r-th seed.
+
+The output is the (replicate, step, metric) cube of the columns of
+ColumnarCollector, the layout of the experiment store:
+
+    batch = ReplicateBatch(range(50), criminal_disconnectivity=25)
+    batch.run_model(300)
+    means, cis = get_means_cis(batch.get_data('Crimes commited'))
+    get_average_crime_per_distr(batch.get_dataframes(), districts, 100)
+"""
+
+import numpy as np
+
+from array_engine import ArrayEngine
+from collector import ColumnarCollector
+from model import SugarscapeCg
+
+
+class ReplicateBatch:
+    """
+    Replicates of the same configuration of SugarscapeCg, stepped together.
+    """
+
+    columns = ColumnarCollector.columns
+
+    def __init__(self, seeds, capacity=301, **parameters):
+        """
+        Args:
+            seeds: seed of every replicate
+            capacity: number of steps the output has room for up front
+            parameters: parameters of SugarscapeCg, the same for all
+                replicates
+        """
+        self.seeds = list(seeds)
+        self.parameters = parameters
+        models = [
+            SugarscapeCg(seed=seed, engine='arrays', **parameters)
+            for seed in self.seeds
+        ]
+        # the first model holds the configuration of the stacked engine
+        self.model = models[0]
+        self.engine = ArrayEngine.stack(
+            [model.array_engine for model in models]
+        )
+        self.replicates = len(self.seeds)
+        self.time = 0
+        self.district_ids = [
+            self.model.district_ids[district]
+            for district in ColumnarCollector.district_columns
+        ]
+
+        self.data = np.zeros((self.replicates, capacity, len(self.columns)))
+        self.data[:, 0] = [
+            model.datacollector.get_array()[0] for model in models
+        ]
+        self.n_rows = 1
+
+    def reserve(self, n_rows):
+        """
+        Makes sure there is room for n_rows steps in total.
+        """
+        if n_rows > self.data.shape[1]:
+            data = np.zeros((self.replicates, n_rows, len(self.columns)))
+            data[:, :self.n_rows] = self.data[:, :self.n_rows]
+            self.data = data
+
+    def step(self):
+        """
+        Advances all replicates one step and collects their data.
+        """
+        self.engine.step()
+        self.time += 1
+        self.collect()
+
+    def run_model(self, step_count=300):
+        """
+        Runs all replicates step by step.
+        """
+        self.reserve(self.n_rows + step_count)
+        for i in range(step_count):
+            self.step()
+
+    def update_average_crimes(self):
+        """
+        SugarscapeCg.update_average_crimes for all replicates.
+        """
+        burn_in_period = self.model.burn_in_period
+        average = self.engine.average_crimes_per_district
+        if self.time > burn_in_period:
+            average *= (self.time - 1) - burn_in_period
+            average += self.engine.crimes_per_district_step
+            average /= self.time - burn_in_period
+
+    def collect(self):
+        """
+        Computes the reporters of ColumnarCollector for all replicates
+        and stores them as the next step.
+        """
+        if self.n_rows == self.data.shape[1]:
+            self.reserve(2 * self.data.shape[1])
+
+        wealth, count, in_jail, crimes = self.engine.get_criminal_totals()
+        self.update_average_crimes()
+
+        rows = self.data[:, self.n_rows]
+        rows[:, 0] = wealth
+        rows[:, 1] = count
+        rows[:, 2] = in_jail
+        rows[:, 3] = crimes
+        rows[:, 4:11] = self.engine.crimes_per_district_step[
+            :, self.district_ids
+        ]
+        rows[:, 11:18] = self.engine.average_crimes_per_district[
+            :, self.district_ids
+        ]
+        self.n_rows += 1
+
+    def get_array(self):
+        """
+        Returns the collected (replicate, step, metric) array view.
+        """
+        return self.data[:, :self.n_rows]
+
+    def metric(self, name):
+        """
+        Returns the (replicate, step) view of a single metric.
+        """
+        return self.get_array()[:, :, self.columns.index(name)]
+
+    def get_data(self, name):
+        """
+        Returns a metric as a (step, replicate) array,
+        like get_data in run_no_visual.ipynb.
+        """
+        return self.metric(name).T
+
+    def get_dataframes(self):
+        """
+        Returns every replicate as a DataFrame,
+        like the outputs of run_model in run_no_visual.ipynb.
+        """
+        import pandas as pd
+
+        return [
+            pd.DataFrame(replicate, columns=self.columns)
+            for replicate in self.get_array()
+        ]
+
+
+def run_replicates(seeds, step_count=300, **parameters):
+    """
+    Returns the (replicate, step, metric) array of a batch
+    of replicates run for step_count steps.
+    """
+    batch = ReplicateBatch(seeds, capacity=step_count + 1, **parameters)
+    batch.run_model(step_count)
+    return batch.get_array()
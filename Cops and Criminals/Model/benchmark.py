@@ -0,0 +1,204 @@
+"""
+Step-time benchmark of SugarscapeCg.
+
+Every case runs the model with one parameter changed from the default,
+along the axes of the Saltelli bounds in run_no_visual.ipynb and the
+population and grid sizes, and measures the steps per second and the
+time per step of each phase: Sugar, Criminal, Cop and data collection.
+
+Usage from the Model folder:
+
+    python benchmark.py run baseline.json
+    python benchmark.py run current.json
+    python benchmark.py compare baseline.json current.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import kernels
+from agents import Cop, Criminal
+from model import SugarscapeCg
+from store import code_version
+
+# values of each axis, the first value of every axis is the default;
+# the populations are scaled with the grid size by the model
+axes = {
+    'initial_population_criminals': [45, 200, 1000],
+    'initial_population_cops': [40, 100, 200],
+    'criminal_risk_radius': [5, 1, 10],
+    'criminal_disconnectivity': [45, 0, 100],
+    'grid_size': [50, 100, 200]
+}
+
+phases = ['Sugar', 'Criminal', 'Cop', 'Collect']
+
+
+def get_cases():
+    """
+    Returns the parameters of every case, by name.
+    """
+    cases = {'default': {}}
+    for axis, values in axes.items():
+        for value in values[1:]:
+            cases[f'{axis}={value}'] = {axis: value}
+    return cases
+
+
+def model_parameters(case):
+    """
+    Returns the SugarscapeCg parameters of a case.
+    """
+    parameters = dict(case)
+    if 'grid_size' in parameters:
+        size = parameters.pop('grid_size')
+        parameters['height'] = size
+        parameters['width'] = size
+    return parameters
+
+
+def timed(function, timings, phase):
+    """
+    Wraps a function so that its run time is added to timings[phase].
+    """
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        timings[phase] += time.perf_counter() - start
+        return result
+    return wrapper
+
+
+def time_run(case, steps=50, seed=0):
+    """
+    Runs the model of a case and returns the steps per second
+    and the time per step of each phase.
+    """
+    model = SugarscapeCg(seed=seed, **model_parameters(case))
+    timings = dict.fromkeys(phases, 0.0)
+
+    # the risk field and the plans are computed for the criminals
+    model.sugar.step = timed(model.sugar.step, timings, 'Sugar')
+    model.update_risk_field = timed(
+        model.update_risk_field, timings, 'Criminal'
+    )
+    model.plan_criminal_moves = timed(
+        model.plan_criminal_moves, timings, 'Criminal'
+    )
+    model.datacollector.collect = timed(
+        model.datacollector.collect, timings, 'Collect'
+    )
+    step_breed = model.schedule.step_breed
+    breed_phases = {Criminal: 'Criminal', Cop: 'Cop'}
+
+    def timed_step_breed(breed):
+        timed(step_breed, timings, breed_phases[breed])(breed)
+    model.schedule.step_breed = timed_step_breed
+
+    start = time.perf_counter()
+    model.run_model(step_count=steps)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'steps_per_second': steps / elapsed,
+        'phases': {phase: timings[phase] / steps for phase in phases}
+    }
+
+
+def run_benchmark(steps=50, repeats=3, cases=None, verbose=True):
+    """
+    Runs every case repeats times and returns the median timings,
+    together with a description of the code and the machine.
+    """
+    cases = get_cases() if cases is None else cases
+    # time the steps with compiled kernels, not their compilation
+    warm_up_seconds = kernels.warm_up()
+    results = {}
+    for name, case in cases.items():
+        runs = [time_run(case, steps, seed) for seed in range(repeats)]
+        results[name] = {
+            'params': case,
+            'steps_per_second': float(np.median(
+                [run['steps_per_second'] for run in runs]
+            )),
+            'phases': {
+                phase: float(np.median([run['phases'][phase] for run in runs]))
+                for phase in phases
+            }
+        }
+        if verbose:
+            print(f"{name:40} {results[name]['steps_per_second']:8.2f} steps/s")
+
+    return {
+        'code_version': code_version(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'steps': steps,
+        'repeats': repeats,
+        'warm_up_seconds': warm_up_seconds,
+        'cases': results
+    }
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Returns the regressions of current compared to baseline: the cases
+    and phases that got more than threshold slower.
+    """
+    regressions = []
+    for name, result in current['cases'].items():
+        if name not in baseline['cases']:
+            continue
+        reference = baseline['cases'][name]
+        ratio = reference['steps_per_second'] / result['steps_per_second']
+        if ratio > 1 + threshold:
+            regressions.append((name, 'steps', ratio))
+        for phase in phases:
+            # ignore phases too short to time reliably
+            if reference['phases'][phase] < 1e-4:
+                continue
+            ratio = result['phases'][phase] / reference['phases'][phase]
+            if ratio > 1 + threshold:
+                regressions.append((name, phase, ratio))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmark')
+    run_parser.add_argument('output', help='path of the results JSON')
+    run_parser.add_argument('--steps', type=int, default=50)
+    run_parser.add_argument('--repeats', type=int, default=3)
+
+    compare_parser = commands.add_parser(
+        'compare', help='flag regressions against a baseline'
+    )
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_benchmark(args.steps, args.repeats)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+        regressions = compare(baseline, current, args.threshold)
+        for name, phase, ratio in regressions:
+            print(f'{name:40} {phase:10} {ratio:5.2f}x slower')
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
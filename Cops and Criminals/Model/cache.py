@@ -0,0 +1,300 @@
+"""
+On-disk cache of the collected output of model runs.
+
+A run is identified by a hash of everything that determines its output:
+all parameters of SugarscapeCg (its defaults with the given parameters
+filled in, so passing a default value finds the same run), the seed, the
+number of steps, the contents of the map file and the fingerprint of the
+model code (store.code_version). A run that is in the cache is returned at once
+instead of simulated again, so notebook cells can be rerun freely:
+
+    cache = RunCache()
+    output = cache.run_dataframe(step_count=300, seed=1, jail_sentence=5)
+
+Every entry is a .npy file with a checksum in index.json. Entries whose
+checksum does not match are dropped and run again, and the least
+recently used entries are evicted when the cache grows beyond max_bytes.
+The index is replaced atomically and merged with the index on disk, so
+notebooks and sweep workers can share a cache; the use times of hits
+are written at most every index_interval seconds.
+Runs without a seed are random and are never cached, nor are runs that
+collect their own timings (profile_columns).
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from city_map import default_map
+from collector import ColumnarCollector
+from model import SugarscapeCg
+from store import code_version
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+default_path = os.path.join(base_path, 'run_cache')
+
+# the parameters of SugarscapeCg that do not change the output of a run
+untracked_parameters = ('self', 'seed', 'map_file', 'profile')
+
+
+def default_parameters():
+    """
+    Returns the default values of the parameters of SugarscapeCg.
+    """
+    return {
+        name: parameter.default
+        for name, parameter in
+        inspect.signature(SugarscapeCg.__init__).parameters.items()
+        if name not in untracked_parameters
+    }
+
+
+def file_digest(path):
+    """
+    Returns the sha256 of the contents of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RunCache:
+    """
+    A size-bounded, least recently used cache of run outputs in a folder.
+    """
+
+    def __init__(
+        self, path=default_path, max_bytes=512 * 2 ** 20, index_interval=30
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.index_interval = index_interval
+        os.makedirs(path, exist_ok=True)
+        self.version = code_version()
+        self.index = self.read_index()
+        # keys removed since the last write, so the merge does not revive them
+        self.removed = set()
+        self.index_written = time.time()
+
+    def read_index(self):
+        index_path = os.path.join(self.path, 'index.json')
+        if not os.path.exists(index_path):
+            return {}
+        try:
+            with open(index_path) as f:
+                return json.load(f)
+        except ValueError:
+            # a broken index only loses the entries, not the results
+            return {}
+
+    def merge_index(self):
+        """
+        Merges the index with the one on disk, which other processes may
+        have written since it was read.
+        """
+        index = self.read_index()
+        for key in self.removed:
+            index.pop(key, None)
+        for key, entry in self.index.items():
+            if key in index:
+                entry['last_used'] = max(
+                    entry['last_used'], index[key]['last_used']
+                )
+            index[key] = entry
+        self.index = index
+        self.removed = set()
+
+    def write_index(self):
+        """
+        Merges the index with the one on disk and replaces it atomically.
+        """
+        self.merge_index()
+        # a file of its own, so that writers do not replace each other's
+        handle, temporary = tempfile.mkstemp(
+            dir=self.path, prefix='index.', suffix='.tmp'
+        )
+        try:
+            with os.fdopen(handle, 'w') as f:
+                json.dump(self.index, f, indent=1)
+            os.replace(temporary, os.path.join(self.path, 'index.json'))
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.index_written = time.time()
+
+    def flush(self):
+        """
+        Writes the use times of the hits since the last write.
+        """
+        self.write_index()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + '.npy')
+
+    def key(self, parameters, seed, step_count):
+        """
+        Returns the key of a run: the hash of all parameters of
+        SugarscapeCg, its seed, number of steps, map file contents
+        and the model code.
+        """
+        map_file = parameters.get('map_file') or default_map
+        parameters = dict(default_parameters(), **{
+            name: value for name, value in parameters.items()
+            if name not in untracked_parameters
+        })
+        description = {
+            'parameters': {
+                # numpy scalars hash like the numbers they hold
+                name: value.item() if isinstance(value, np.generic) else value
+                for name, value in parameters.items()
+            },
+            'seed': seed,
+            'step_count': step_count,
+            'map': file_digest(map_file),
+            'code_version': self.version
+        }
+        return hashlib.sha256(
+            json.dumps(description, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the output stored under key, or None if it is not in the
+        cache or does not pass the integrity check.
+        """
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        path = self.entry_path(key)
+        if not os.path.exists(path) or file_digest(path) != entry['sha256']:
+            self.remove(key)
+            return None
+        entry['last_used'] = time.time()
+        if time.time() - self.index_written > self.index_interval:
+            self.write_index()
+        return np.load(path)
+
+    def put(self, key, data, **metadata):
+        """
+        Stores an output under key and evicts the least recently used
+        entries if the cache is too large.
+        """
+        path = self.entry_path(key)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, np.ascontiguousarray(data))
+        os.replace(path + '.tmp', path)
+        self.index[key] = dict(
+            metadata,
+            sha256=file_digest(path),
+            size=os.path.getsize(path),
+            last_used=time.time()
+        )
+        self.merge_index()
+        self.evict(keep=key)
+        self.write_index()
+
+    def remove(self, key):
+        """
+        Removes an entry from the cache.
+        """
+        self.index.pop(key, None)
+        self.removed.add(key)
+        if os.path.exists(self.entry_path(key)):
+            os.remove(self.entry_path(key))
+        self.write_index()
+
+    @property
+    def size(self):
+        """
+        Returns the number of bytes of all entries.
+        """
+        return sum(entry['size'] for entry in self.index.values())
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries, except keep,
+        until the cache fits in max_bytes.
+        """
+        size = self.size
+        by_use = sorted(self.index, key=lambda k: self.index[k]['last_used'])
+        for key in by_use:
+            if size <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            size -= self.index[key]['size']
+            self.index.pop(key)
+            self.removed.add(key)
+            if os.path.exists(self.entry_path(key)):
+                os.remove(self.entry_path(key))
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        for key in list(self.index):
+            self.remove(key)
+
+    @staticmethod
+    def is_cacheable(seed, parameters):
+        """
+        Returns whether a run always gives the same output: it has a seed
+        and does not collect its own timings.
+        """
+        return seed is not None and not parameters.get('profile_columns')
+
+    @staticmethod
+    def simulate(step_count, seed, parameters):
+        """
+        Returns the model after a run.
+        """
+        model = SugarscapeCg(seed=seed, **parameters)
+        model.run_model(step_count=step_count)
+        return model
+
+    def run(self, step_count=300, seed=None, **parameters):
+        """
+        Returns the collected (step, metric) array of a run of SugarscapeCg
+        with the parameters, from the cache if it was run before.
+        """
+        if not self.is_cacheable(seed, parameters):
+            model = self.simulate(step_count, seed, parameters)
+            return model.datacollector.get_array()
+
+        key = self.key(parameters, seed, step_count)
+        data = self.get(key)
+        if data is None:
+            model = self.simulate(step_count, seed, parameters)
+            data = model.datacollector.get_array()
+            self.put(
+                key,
+                data,
+                parameters={
+                    name: str(value) for name, value in parameters.items()
+                },
+                seed=seed,
+                step_count=step_count
+            )
+        return data
+
+    def run_dataframe(self, step_count=300, seed=None, **parameters):
+        """
+        Returns the output of run as a DataFrame, like the outputs of
+        run_model in run_no_visual.ipynb.
+        """
+        import pandas as pd
+
+        if not self.is_cacheable(seed, parameters):
+            model = self.simulate(step_count, seed, parameters)
+            return model.datacollector.get_model_vars_dataframe()
+        return pd.DataFrame(
+            self.run(step_count, seed, **parameters),
+            columns=ColumnarCollector.columns
+        )
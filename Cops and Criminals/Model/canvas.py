@@ -0,0 +1,226 @@
+"""
+Canvas of the server that only sends what changed since the last frame.
+
+CanvasGrid sends a portrayal of every sugar cell and every agent on every
+step. With DeltaServer every browser gets the colors of all cells of the
+DeltaCanvasGrid once, after it connects or resets, and after that only
+the cells whose color changed and the cells where agents of a breed
+arrived or left, as flat cell indices (x * height + y). The socket of
+every browser keeps the state it shows, so browsers that share the
+model each get the difference with their own last frame.
+DeltaCanvasModule.js keeps the canvas and redraws only these cells.
+
+A full frame is
+    {"full": true, "palette": [...], "colors": [color of every cell],
+     "agents": [[occupied cells] for every breed]}
+and a delta frame is
+    {"full": false, "palette": [new colors], "cells": [...],
+     "colors": [new color of every one of these cells],
+     "agents": [[cells where agents arrived or left] for every breed]}
+where colors are indices in the palette, which only grows.
+
+The state of a frame (get_state) can be encoded from any earlier state,
+which the BufferedServer of playback.py also does for the steps it
+buffers. Without a server that keeps the states, render sends full
+frames.
+"""
+
+import json
+
+import numpy as np
+from mesa.visualization.ModularVisualization import (
+    ModularServer, SocketHandler, VisualizationElement
+)
+import tornado.escape
+
+from agents import Cop, Criminal
+
+
+class DeltaCanvasGrid(VisualizationElement):
+    """
+    Canvas of the sugar field and the agents, sent as differences
+    between frames.
+    """
+    local_includes = ["DeltaCanvasModule.js"]
+
+    def __init__(
+        self, sugar_color, agent_images, grid_width, grid_height,
+        canvas_width=500, canvas_height=500
+    ):
+        """
+        Args:
+            sugar_color: function that returns the color of a cell
+                with an amount of sugar
+            agent_images: (breed, image, scale) of every breed that is
+                drawn, the last one on top
+            grid_width, grid_height: size of the grid in cells
+            canvas_width, canvas_height: size of the canvas in pixels
+        """
+        self.sugar_color = sugar_color
+        self.agent_images = agent_images
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.canvas_width = canvas_width
+        self.canvas_height = canvas_height
+
+        images = [
+            {"image": image, "scale": scale}
+            for breed, image, scale in agent_images
+        ]
+        self.js_code = (
+            "elements.push(new DeltaCanvasModule("
+            f"{canvas_width}, {canvas_height}, {grid_width}, {grid_height}, "
+            f"{json.dumps(images)}));"
+        )
+        # the palette is shared by all browsers and only grows, so the
+        # states they show stay valid
+        self.palette = []
+        self.color_index = {}
+
+    def get_sugar(self, model):
+        """
+        Returns the (x, y) sugar of the model, of the first replicate
+        for the array engine.
+        """
+        if model.array_engine is not None:
+            return model.array_engine.sugar.amount[0]
+        return model.sugar.amount
+
+    def get_occupied(self, model):
+        """
+        Returns a (breed, x, y) array of whether a cell holds agents
+        of every breed.
+        """
+        engine = model.array_engine
+        layers = []
+        for breed, image, scale in self.agent_images:
+            if engine is None:
+                layers.append(model.grid.occupancy[breed] > 0)
+            elif breed is Criminal:
+                layers.append(engine.get_occupancy(
+                    engine.criminal_x, engine.criminal_y
+                )[0] > 0)
+            elif breed is Cop:
+                layers.append(
+                    engine.get_occupancy(engine.cop_x, engine.cop_y)[0] > 0
+                )
+        return np.array(layers)
+
+    def get_colors(self, model):
+        """
+        Returns the palette index of the color of every cell, adding
+        colors that were not sent before to the palette.
+        """
+        amounts, inverse = np.unique(
+            self.get_sugar(model), return_inverse=True
+        )
+        indices = []
+        for amount in amounts.tolist():
+            color = self.sugar_color(amount)
+            if color not in self.color_index:
+                self.color_index[color] = len(self.palette)
+                self.palette.append(color)
+            indices.append(self.color_index[color])
+        return np.array(indices, dtype=np.int32)[inverse.ravel()]
+
+    def get_state(self, model):
+        """
+        Returns the palette index of the color of every cell, the
+        (breed, cell) array of the cells that hold agents of every breed
+        and the size of the palette.
+        """
+        occupied = self.get_occupied(model).reshape(
+            len(self.agent_images), -1
+        )
+        return self.get_colors(model), occupied, len(self.palette)
+
+    def encode(self, state, previous=None):
+        """
+        Returns the frame that draws a state: the full frame, or the delta
+        frame from the previous state if the browser shows that one.
+        """
+        colors, occupied, n_colors = state
+        if previous is None:
+            return {
+                "full": True,
+                "palette": self.palette[:n_colors],
+                "colors": colors.tolist(),
+                "agents": [np.flatnonzero(layer).tolist()
+                           for layer in occupied]
+            }
+        previous_colors, previous_occupied, previous_n_colors = previous
+        cells = np.flatnonzero(colors != previous_colors)
+        return {
+            "full": False,
+            "palette": self.palette[previous_n_colors:n_colors],
+            "cells": cells.tolist(),
+            "colors": colors[cells].tolist(),
+            "agents": [np.flatnonzero(layer).tolist()
+                       for layer in occupied != previous_occupied]
+        }
+
+    def render(self, model):
+        return self.encode(self.get_state(model))
+
+
+class DeltaSocketHandler(SocketHandler):
+    """
+    Socket of a browser that keeps the states of the elements it shows,
+    so the canvas only gets the difference with them.
+    """
+
+    def open(self):
+        self.shown = None
+        super().open()
+
+    @property
+    def viz_state_message(self):
+        application = self.application
+        states = application.record(application.model)
+        data = application.encode(states, self.shown)
+        self.shown = states
+        return {"type": "viz_state", "data": data}
+
+    def on_message(self, message):
+        if tornado.escape.json_decode(message)["type"] == "reset":
+            # the browser cleared its elements
+            self.shown = None
+        super().on_message(message)
+
+
+class DeltaServer(ModularServer):
+    """
+    ModularServer that sends the elements with a get_state method, like
+    DeltaCanvasGrid, as the difference with what every browser shows.
+    """
+    socket_handler = (r"/ws", DeltaSocketHandler)
+    handlers = [
+        ModularServer.page_handler,
+        socket_handler,
+        ModularServer.static_handler,
+        ModularServer.local_handler
+    ]
+
+    def record(self, model):
+        """
+        Returns the state of every element with a get_state method
+        and the frame of the others.
+        """
+        return [
+            element.get_state(model) if hasattr(element, "get_state")
+            else element.render(model)
+            for element in self.visualization_elements
+        ]
+
+    def encode(self, states, shown=None):
+        """
+        Returns the frames of the states of record, for a browser that
+        shows the states shown, or nothing yet.
+        """
+        return [
+            element.encode(state, None if shown is None else shown[i])
+            if hasattr(element, "get_state") else state
+            for i, (element, state) in enumerate(
+                zip(self.visualization_elements, states)
+            )
+        ]
@@ -0,0 +1,61 @@
+"""
+Loading of the district raster of the city.
+
+A map file is a whitespace separated raster of the initial wealth of
+every cell, which also identifies its district (see district_wealths in
+model.py). The first axis of the raster is x and the second one is y.
+Maps of any resolution can be used, and a map can be resampled to
+another resolution so that the same city can be simulated at 50x50,
+100x100, 400x400 and so on.
+"""
+
+import os
+
+import numpy as np
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+default_map = os.path.join(base_path, 'resources', 'amsterdam50x50new.txt')
+
+
+def resample(raster, width, height):
+    """
+    Resamples a raster to width x height cells by nearest neighbour,
+    so that no new district values are made up at the borders.
+    """
+    x = np.arange(width) * raster.shape[0] // width
+    y = np.arange(height) * raster.shape[1] // height
+    return raster[np.ix_(x, y)]
+
+
+def load_city_map(path=None, width=None, height=None):
+    """
+    Returns the raster of a map file, resampled to width x height cells
+    if either is given. A missing width or height keeps the aspect ratio.
+    """
+    raster = np.genfromtxt(default_map if path is None else path)
+    if width is None and height is None:
+        return raster
+    if width is None:
+        width = round(height * raster.shape[0] / raster.shape[1])
+    elif height is None:
+        height = round(width * raster.shape[1] / raster.shape[0])
+    if (width, height) == raster.shape:
+        return raster
+    return resample(raster, width, height)
+
+
+def district_centers(district_cells):
+    """
+    Returns the center of every district, by district id: the cell of the
+    district nearest to its centroid, so that the center always lies in
+    the district. Districts without cells have no center (None).
+    """
+    centers = []
+    for cells in district_cells:
+        if len(cells) == 0:
+            centers.append(None)
+            continue
+        distances = ((cells - cells.mean(axis=0)) ** 2).sum(axis=1)
+        x, y = cells[np.argmin(distances)]
+        centers.append((int(x), int(y)))
+    return centers
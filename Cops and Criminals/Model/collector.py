@@ -0,0 +1,98 @@
+import numpy as np
+
+
+class ColumnarCollector:
+    """
+    Collects the model reporters of SugarscapeCg once per step
+    into preallocated NumPy columns.
+
+    All reporters are computed from the totals of the criminals and the
+    per-district crime counters of the model. Rows are written into an
+    array that is sized up front by run_model, so the memory of a run
+    is fixed; it only grows when the model steps past its size.
+    Extra reporters (name: function of the model) are added as columns
+    after the standard ones.
+    """
+
+    district_columns = [
+        "Centrum",
+        "Noord",
+        "West",
+        "Zuid",
+        "Zuidoost",
+        "Oost",
+        "Nieuw-West"
+    ]
+    columns = (
+        [
+            "Criminal Wealth",
+            "Criminal Count",
+            "Criminal in Jail Count",
+            "Crimes commited"
+        ]
+        + district_columns
+        + [district + "_Avg" for district in district_columns]
+    )
+
+    def __init__(self, capacity=301, extra_reporters=None):
+        self.extra_reporters = extra_reporters or {}
+        self.columns = self.columns + list(self.extra_reporters)
+        self.data = np.zeros((capacity, len(self.columns)))
+        self.n_rows = 0
+
+    def reserve(self, n_rows):
+        """
+        Makes sure there is room for n_rows rows in total.
+        """
+        if n_rows > len(self.data):
+            data = np.zeros((n_rows, len(self.columns)))
+            data[:self.n_rows] = self.data[:self.n_rows]
+            self.data = data
+
+    def collect(self, model):
+        """
+        Computes all reporters of the current step and stores them as a row.
+        """
+        if self.n_rows == len(self.data):
+            self.reserve(2 * len(self.data))
+
+        wealth, count, in_jail, crimes = model.get_criminal_totals()
+        district_ids = [
+            model.district_ids[district] for district in self.district_columns
+        ]
+        model.update_average_crimes()
+
+        row = self.data[self.n_rows]
+        row[0] = wealth
+        row[1] = count
+        row[2] = in_jail
+        row[3] = crimes
+        row[4:11] = model.crimes_per_district_step[district_ids]
+        row[11:18] = model.average_crimes_per_district[district_ids]
+        for index, reporter in enumerate(self.extra_reporters.values()):
+            row[18 + index] = reporter(model)
+        self.n_rows += 1
+
+    def get_array(self):
+        """
+        Returns the collected rows as a (steps, reporters) array view.
+        """
+        return self.data[:self.n_rows]
+
+    @property
+    def model_vars(self):
+        """
+        Returns the collected column of every reporter, by name.
+        """
+        return {
+            name: self.data[:self.n_rows, index]
+            for index, name in enumerate(self.columns)
+        }
+
+    def get_model_vars_dataframe(self):
+        """
+        Returns the collected rows as a pandas DataFrame.
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self.get_array(), columns=self.columns)
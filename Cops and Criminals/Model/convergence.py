@@ -0,0 +1,145 @@
+"""
+Steady-state detection for runs of SugarscapeCg.
+
+A ConvergenceMonitor passed to SugarscapeCg.run_model watches the crimes
+per step of every district in the collected data. The end of the warm-up
+is detected with the MSER-5 rule, and the standard error of the mean
+crimes per step after it is estimated with batch means. The run stops as
+soon as the confidence interval of every district is within tolerance:
+
+    monitor = ConvergenceMonitor(tolerance=0.25)
+    model.run_model(step_count=1000, convergence=monitor)
+    model.convergence['stop_step'], model.convergence['warm_up']
+"""
+
+import numpy as np
+
+from collector import ColumnarCollector
+
+
+def mser(series, batch_size=5):
+    """
+    Returns the warm-up of every column of a (step, column) series by the
+    MSER rule on batches of batch_size steps: the truncation that
+    minimizes the squared standard error of the remaining mean, searched
+    over the first half of the series. Also returns whether the warm-up
+    was found within the first half for every column; if not, the series
+    is too short to tell.
+    """
+    series = np.asarray(series, dtype=float)
+    n_batches = len(series) // batch_size
+    if n_batches < 2:
+        return np.zeros(series.shape[1], dtype=int), False
+    batches = series[:n_batches * batch_size].reshape(
+        n_batches, batch_size, -1
+    ).mean(axis=1)
+
+    # sums over the last batches, for every number of batches kept
+    kept = np.arange(1, n_batches + 1)[:, None]
+    sums = np.cumsum(batches[::-1], axis=0)
+    squares = np.cumsum(batches[::-1] ** 2, axis=0)
+    deviations = np.maximum(squares - sums ** 2 / kept, 0)
+    statistic = (deviations / kept ** 2)[::-1]
+
+    limit = n_batches // 2
+    truncation = np.argmin(statistic[:limit + 1], axis=0)
+    return truncation * batch_size, bool((truncation < limit).all())
+
+
+def batch_means(series, n_batches=10):
+    """
+    Returns the mean and the batch means standard error of every column
+    of a (step, column) series, from n_batches batches of equal length.
+    Steps that do not fill a batch are dropped from the start.
+    """
+    series = np.asarray(series, dtype=float)
+    batch_size = len(series) // n_batches
+    series = series[len(series) - n_batches * batch_size:]
+    batches = series.reshape(n_batches, batch_size, -1).mean(axis=1)
+    return (
+        series.mean(axis=0),
+        batches.std(axis=0, ddof=1) / np.sqrt(n_batches)
+    )
+
+
+class ConvergenceMonitor:
+    """
+    Decides when the district averages of a run have converged.
+
+    A run has converged when the warm-up of every district is found and
+    the half width of the confidence interval of the mean crimes per step
+    after the warm-up is at most tolerance times the mean, or at most
+    absolute_tolerance, for every district.
+    """
+
+    def __init__(
+        self, tolerance=0.25, absolute_tolerance=0.25, min_steps=100,
+        check_every=10, batch_size=5, n_batches=10, z=1.96,
+        districts=ColumnarCollector.district_columns
+    ):
+        """
+        Args:
+            tolerance: half width of the confidence interval relative
+                to the mean of a district
+            absolute_tolerance: half width that is always small enough,
+                for districts with (almost) no crimes
+            min_steps: steps before the first check
+            check_every: steps between two checks
+            batch_size: steps per batch of the MSER rule
+            n_batches: batches of the standard error
+            z: quantile of the confidence interval
+            districts: columns of the collected data that are watched
+        """
+        self.tolerance = tolerance
+        self.absolute_tolerance = absolute_tolerance
+        self.min_steps = min_steps
+        self.check_every = check_every
+        self.batch_size = batch_size
+        self.n_batches = n_batches
+        self.z = z
+        self.districts = list(districts)
+        self.diagnostic = None
+
+    def check(self, model):
+        """
+        Updates the diagnostic from the data collected so far
+        and returns whether the run has converged.
+        """
+        time = model.schedule.time
+        if time < self.min_steps or time % self.check_every != 0:
+            return False
+        self.diagnostic = self.diagnose(model)
+        return self.diagnostic['converged']
+
+    def diagnose(self, model):
+        """
+        Returns the convergence diagnostic of the data collected so far:
+        the step, the warm-up, and the mean and the half width of the
+        confidence interval of every district.
+        """
+        collector = model.datacollector
+        columns = [collector.columns.index(name) for name in self.districts]
+        # the first row is the state before the first step
+        series = collector.get_array()[1:, columns]
+        warm_ups, found = mser(series, self.batch_size)
+        warm_up = int(warm_ups.max())
+
+        converged = False
+        means = np.full(len(columns), np.nan)
+        half_widths = np.full(len(columns), np.inf)
+        if len(series) - warm_up >= self.n_batches * self.batch_size:
+            means, errors = batch_means(series[warm_up:], self.n_batches)
+            half_widths = self.z * errors
+            converged = found and bool((
+                half_widths <= np.maximum(
+                    self.tolerance * np.abs(means), self.absolute_tolerance
+                )
+            ).all())
+
+        return {
+            'converged': converged,
+            'stop_step': int(model.schedule.time),
+            'warm_up': warm_up,
+            'means': dict(zip(self.districts, means.tolist())),
+            'half_widths': dict(zip(self.districts, half_widths.tolist()))
+        }
@@ -0,0 +1,279 @@
+"""
+Statistical equivalence check of the array engine against the object engine.
+
+Both engines run replicates of the same parameters, and the outputs that
+run_no_visual.ipynb analyses are compared: the average crimes per district
+after the burn-in (get_average_crime_per_distr) and the Kolmogorov-Smirnov
+test of these averages against Zipf's law (ks_test).
+
+The engines differ if a two-sample KS test tells the replicate averages
+of a district apart at alpha. Not finding a difference does not show
+that there is none, so the engines are only taken to be equivalent if a
+two one-sided t-test (TOST) bounds the difference of the mean of every
+district within the margin at equivalence_alpha: margin times the mean
+of the object engine, and at least min_margin crimes per step. Every
+district also gets its effect size, the difference of the means divided
+by their pooled standard deviation. If neither holds, no difference is
+detected, which with few replicates may hide a large one.
+
+With --samples the check runs for every row of the first base samples of
+the Saltelli sample of sweep.py, so across the bounds of the sensitivity
+analysis, with the KS tests at alpha divided by the number of rows. The
+TOST needs no correction, since all rows must pass it.
+
+Usage from the Model folder:
+
+    python equivalence.py --replicates 20 --criminal_risk_radius 8
+    python equivalence.py --replicates 30 --samples 2
+    python equivalence.py --replicates 100 --margin 0.1
+"""
+
+import argparse
+import sys
+
+import numpy as np
+from scipy import stats
+
+import batch
+from collector import ColumnarCollector
+from model import SugarscapeCg
+import sweep
+
+district_names = ColumnarCollector.district_columns
+engines = ['objects', 'arrays']
+
+
+def zipf(height):
+    """
+    Returns x, y values following zipf's law given a starting height
+    and x values between 0 and 6, like zipf in run_no_visual.ipynb.
+    """
+    x = np.linspace(1, 7, 1000)
+    y = height / x
+    y = np.flip(y)
+    x = np.linspace(0, 6, 1000)
+    return x, y
+
+
+def ks_test(averages):
+    """
+    Returns the Kolmogorov-Smirnov test between the average crimes of the
+    districts and zipf's law, like ks_test in run_no_visual.ipynb.
+    """
+    return stats.kstest(averages, zipf(max(averages))[1])
+
+
+def district_means(outputs, burn_in=100):
+    """
+    Returns the (replicate, district) averages of the crimes per step
+    after the burn-in, from the collected (step, metric) arrays.
+    """
+    columns = [
+        ColumnarCollector.columns.index(district)
+        for district in district_names
+    ]
+    return np.array([output[burn_in:, columns].mean(axis=0)
+                     for output in outputs])
+
+
+def run_replicates(engine, seeds, max_steps=300, **parameters):
+    """
+    Returns the collected (step, metric) array of a run of every seed.
+    The replicates of the array engine run as one batch.
+    """
+    if engine == 'arrays':
+        return list(batch.run_replicates(seeds, max_steps, **parameters))
+    outputs = []
+    for seed in seeds:
+        model = SugarscapeCg(seed=seed, engine=engine, **parameters)
+        model.run_model(step_count=max_steps)
+        outputs.append(model.datacollector.get_array())
+    return outputs
+
+
+def tost(objects, arrays, margin):
+    """
+    Returns the p-value of the two one-sided Welch t-tests of whether the
+    difference of the means of two samples lies within the margin.
+    """
+    difference = arrays.mean() - objects.mean()
+    if objects.std() == 0 and arrays.std() == 0:
+        # constant samples, the difference is exact
+        return 0.0 if abs(difference) < margin else 1.0
+    above = stats.ttest_ind(
+        arrays + margin, objects, equal_var=False, alternative='greater'
+    )
+    below = stats.ttest_ind(
+        arrays - margin, objects, equal_var=False, alternative='less'
+    )
+    return float(max(above.pvalue, below.pvalue))
+
+
+def effect_size(objects, arrays):
+    """
+    Returns the difference of the means of two samples divided by their
+    pooled standard deviation (Cohen's d), 0 for constant samples.
+    """
+    pooled = np.sqrt((objects.var(ddof=1) + arrays.var(ddof=1)) / 2)
+    if pooled == 0:
+        return 0.0
+    return float((arrays.mean() - objects.mean()) / pooled)
+
+
+def compare_engines(
+    replicates=20, max_steps=300, seed=0, burn_in=100, alpha=0.01,
+    margin=0.2, min_margin=0.05, equivalence_alpha=0.05, **parameters
+):
+    """
+    Runs both engines and returns the district averages, their confidence
+    bounds, the Zipf KS test of each engine, and for every district the
+    difference of the means, its effect size, the two-sample KS test and
+    the TOST, and whether the engines differ or are equivalent.
+    """
+    seeds = np.random.SeedSequence(seed).generate_state(2 * replicates)
+    means = {}
+    for index, engine in enumerate(engines):
+        outputs = run_replicates(
+            engine,
+            [int(s) for s in seeds[index::2]],
+            max_steps,
+            **parameters
+        )
+        means[engine] = district_means(outputs, burn_in)
+
+    result = {'districts': {}, 'zipf': {}}
+    for engine in engines:
+        averages = means[engine].mean(axis=0)
+        test = ks_test(list(averages))
+        result['zipf'][engine] = {
+            'statistic': float(test.statistic),
+            'pvalue': float(test.pvalue)
+        }
+    for index, district in enumerate(district_names):
+        objects = means['objects'][:, index]
+        arrays = means['arrays'][:, index]
+        test = stats.ks_2samp(objects, arrays)
+        district_margin = max(margin * objects.mean(), min_margin)
+        result['districts'][district] = {
+            engine: {
+                'mean': float(means[engine][:, index].mean()),
+                # 95% confidence bound of the mean, with the standard
+                # error (the notebook divides by replicates instead)
+                'ci': float(
+                    1.96 * means[engine][:, index].std(ddof=1)
+                    / np.sqrt(replicates)
+                )
+            }
+            for engine in engines
+        }
+        result['districts'][district].update({
+            'difference': float(arrays.mean() - objects.mean()),
+            'effect_size': effect_size(objects, arrays),
+            'pvalue': float(test.pvalue),
+            'margin': float(district_margin),
+            'tost_pvalue': tost(objects, arrays, district_margin)
+        })
+    districts = result['districts'].values()
+    result['different'] = any(
+        values['pvalue'] < alpha for values in districts
+    )
+    result['equivalent'] = all(
+        values['tost_pvalue'] < equivalence_alpha for values in districts
+    )
+    return result
+
+
+def compare_across_bounds(samples=1, alpha=0.01, **settings):
+    """
+    Runs compare_engines for every row of the first samples base samples
+    of the Saltelli sample, at alpha divided by the number of rows, with
+    the other settings and parameters as given. The rows set the
+    parameters of the sensitivity analysis.
+
+    Returns the parameters and the result of every row.
+    """
+    rows = sweep.saltelli_block(0, samples)
+    results = []
+    for row in rows:
+        parameters = dict(zip(sweep.problem['names'], row.tolist()))
+        results.append((
+            parameters,
+            compare_engines(
+                alpha=alpha / len(rows), **{**settings, **parameters}
+            )
+        ))
+    return results
+
+
+def print_result(result):
+    """
+    Prints the district averages and tests of compare_engines.
+    """
+    print(
+        f"{'district':12} {'objects':>16} {'arrays':>16} {'d':>6} "
+        f"{'KS p':>6} {'margin':>6} {'TOST p':>6}"
+    )
+    for district, values in result['districts'].items():
+        print(
+            f"{district:12} "
+            + ' '.join(
+                f"{values[engine]['mean']:8.3f} ±{values[engine]['ci']:6.3f}"
+                for engine in engines
+            )
+            + f" {values['effect_size']:6.2f} {values['pvalue']:6.3f}"
+            + f" {values['margin']:6.3f} {values['tost_pvalue']:6.3f}"
+        )
+    for engine in engines:
+        zipf_test = result['zipf'][engine]
+        print(
+            f"Zipf KS {engine:8} statistic {zipf_test['statistic']:.3f} "
+            f"p {zipf_test['pvalue']:.3f}"
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--replicates', type=int, default=20)
+    parser.add_argument('--max_steps', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--alpha', type=float, default=0.01)
+    parser.add_argument('--margin', type=float, default=0.2)
+    parser.add_argument('--min_margin', type=float, default=0.05)
+    parser.add_argument('--equivalence_alpha', type=float, default=0.05)
+    parser.add_argument('--samples', type=int)
+    for name in [
+        'initial_population_criminals', 'initial_population_cops',
+        'criminal_risk_radius', 'cop_catch_radius', 'jail_sentence',
+        'criminal_risk_aversion', 'criminal_disconnectivity'
+    ]:
+        parser.add_argument(f'--{name}', type=int)
+    args = vars(parser.parse_args())
+    settings = {
+        key: args.pop(key)
+        for key in [
+            'replicates', 'max_steps', 'seed', 'alpha', 'margin',
+            'min_margin', 'equivalence_alpha'
+        ]
+    }
+    samples = args.pop('samples')
+    parameters = {key: value for key, value in args.items() if value is not None}
+
+    if samples is None:
+        results = [(parameters, compare_engines(**settings, **parameters))]
+    else:
+        results = compare_across_bounds(samples, **settings, **parameters)
+    for row, result in results:
+        if samples is not None:
+            print(' '.join(f"{name} {value}" for name, value in row.items()))
+        print_result(result)
+    if any(result['different'] for row, result in results):
+        print('The engines differ')
+        sys.exit(1)
+    if all(result['equivalent'] for row, result in results):
+        print('The engines are equivalent within the margin')
+    else:
+        print(
+            'No difference detected, but equivalence within the margin '
+            'is not shown; run more replicates'
+        )
+        sys.exit(2)
@@ -0,0 +1,223 @@
+"""
+Experiments with an adaptive number of replicates.
+
+Instead of a fixed num_runs per scenario as in run_no_visual.ipynb, the
+replicates of a scenario are added in parallel batches until the 95%
+confidence interval of every tracked metric is narrow enough. A metric
+of a replicate is its average over the steps after the burn-in, like
+get_average_crime_per_distr, and the mean and variance over the
+replicates are updated online with Welford's algorithm.
+
+Replicate i of a scenario always gets the seed row_seed(seed, i), so the
+result does not depend on the batch size or the number of processes.
+
+Usage from the Model folder:
+
+    python experiment.py jail_sentence 0 5 10 20 --relative 0.05
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import kernels
+from collector import ColumnarCollector
+from model import SugarscapeCg
+from sweep import row_seed
+
+
+class RunningStats:
+    """
+    Mean and variance of a vector of metrics over replicates,
+    updated one replicate at a time with Welford's algorithm.
+    """
+
+    def __init__(self, size):
+        self.count = 0
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+
+    def update(self, values):
+        """
+        Adds the metrics of a replicate.
+        """
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (values - self.mean)
+
+    @property
+    def variance(self):
+        """
+        Returns the sample variance of every metric.
+        """
+        if self.count < 2:
+            return np.full(self.mean.shape, np.inf)
+        return self.m2 / (self.count - 1)
+
+    def half_width(self, z=1.96):
+        """
+        Returns the half width of the confidence interval of every mean.
+        """
+        return z * np.sqrt(self.variance / max(self.count, 1))
+
+
+def replicate_metrics(
+    seed, parameters, metrics, burn_in=100, max_steps=300, engine='objects'
+):
+    """
+    Runs one replicate and returns the average of every metric
+    over the steps after the burn-in.
+    """
+    model = SugarscapeCg(seed=seed, engine=engine, **parameters)
+    model.run_model(step_count=max_steps)
+    collector = model.datacollector
+    columns = [collector.columns.index(name) for name in metrics]
+    return collector.get_array()[burn_in:, columns].mean(axis=0)
+
+
+def batch_metrics(
+    seeds, parameters, metrics, burn_in=100, max_steps=300,
+    engine='objects', pool=None
+):
+    """
+    Returns the (replicate, metric) averages of the replicates of seeds,
+    run on the pool of processes or, for the array engine, as one batch.
+    """
+    if engine == 'arrays':
+        from batch import run_replicates
+
+        cube = run_replicates(seeds, max_steps, **parameters)
+        columns = [ColumnarCollector.columns.index(name) for name in metrics]
+        return cube[:, burn_in:, columns].mean(axis=1)
+
+    arguments = (parameters, metrics, burn_in, max_steps, engine)
+    if pool is None:
+        return np.array([
+            replicate_metrics(seed, *arguments) for seed in seeds
+        ])
+    futures = [
+        pool.submit(replicate_metrics, seed, *arguments) for seed in seeds
+    ]
+    return np.array([future.result() for future in futures])
+
+
+def is_precise(stats, absolute=None, relative=None, z=1.96):
+    """
+    Returns whether the half width of the confidence interval of every
+    metric is below the absolute target or the relative target
+    (a fraction of the mean), whichever is given and larger.
+    """
+    target = np.zeros(stats.mean.shape)
+    if absolute is not None:
+        target = np.maximum(target, absolute)
+    if relative is not None:
+        target = np.maximum(target, relative * np.abs(stats.mean))
+    return bool((stats.half_width(z) <= target).all())
+
+
+def run_adaptive(
+    parameters=None, metrics=ColumnarCollector.district_columns,
+    absolute=None, relative=0.05, batch_size=10, min_replicates=10,
+    max_replicates=200, burn_in=100, max_steps=300, seed=0,
+    engine='objects', pool=None, z=1.96
+):
+    """
+    Adds replicates of a scenario in batches until the confidence interval
+    of every metric is within target, or max_replicates are done.
+
+    Returns the number of replicates it took, whether the target was met,
+    the mean and half width of every metric and the metrics of every
+    replicate.
+    """
+    if absolute is None and relative is None:
+        raise ValueError("Give an absolute or a relative target")
+    parameters = parameters or {}
+    metrics = list(metrics)
+    stats = RunningStats(len(metrics))
+    values = []
+    precise = False
+    while stats.count < max_replicates:
+        size = min(
+            max(batch_size, min_replicates - stats.count),
+            max_replicates - stats.count
+        )
+        seeds = [
+            row_seed(seed, replicate)
+            for replicate in range(stats.count, stats.count + size)
+        ]
+        batch = batch_metrics(
+            seeds, parameters, metrics, burn_in, max_steps, engine, pool
+        )
+        # in replicate order, so the result does not depend on the pool
+        for replicate in batch:
+            stats.update(replicate)
+        values.extend(batch)
+        precise = is_precise(stats, absolute, relative, z)
+        if stats.count >= min_replicates and precise:
+            break
+
+    return {
+        'parameters': parameters,
+        'replicates': stats.count,
+        'precise': precise,
+        'means': dict(zip(metrics, stats.mean.tolist())),
+        'half_widths': dict(zip(metrics, stats.half_width(z).tolist())),
+        'values': np.array(values)
+    }
+
+
+def run_experiment(scenarios, processes=None, **settings):
+    """
+    Runs run_adaptive for every scenario (name: parameters) on a shared
+    pool of processes and returns the results by name. The array engine
+    runs every batch in this process instead.
+    """
+    if settings.get('engine') == 'arrays':
+        return {
+            name: run_adaptive(parameters, **settings)
+            for name, parameters in scenarios.items()
+        }
+    # compile the kernels once, not in every worker
+    kernels.warm_up()
+    with ProcessPoolExecutor(processes) as pool:
+        return {
+            name: run_adaptive(parameters, pool=pool, **settings)
+            for name, parameters in scenarios.items()
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('parameter', help='parameter of SugarscapeCg')
+    parser.add_argument('values', type=int, nargs='+')
+    parser.add_argument('--absolute', type=float, default=None)
+    parser.add_argument('--relative', type=float, default=None)
+    parser.add_argument('--batch_size', type=int, default=10)
+    parser.add_argument('--min_replicates', type=int, default=10)
+    parser.add_argument('--max_replicates', type=int, default=200)
+    parser.add_argument('--burn_in', type=int, default=100)
+    parser.add_argument('--max_steps', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engine', default='objects')
+    parser.add_argument('--processes', type=int, default=None)
+    args = vars(parser.parse_args())
+    if args['absolute'] is None and args['relative'] is None:
+        args['relative'] = 0.05
+
+    parameter = args.pop('parameter')
+    scenarios = {
+        value: {parameter: value} for value in args.pop('values')
+    }
+    results = run_experiment(scenarios, **args)
+    for value, result in results.items():
+        print(
+            f"{parameter}={value}: {result['replicates']} replicates"
+            + ('' if result['precise'] else ' (target not met)')
+        )
+        for metric, mean in result['means'].items():
+            print(
+                f"    {metric:12} {mean:8.3f} "
+                f"±{result['half_widths'][metric]:6.3f}"
+            )
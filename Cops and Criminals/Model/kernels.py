@@ -0,0 +1,270 @@
+"""
+Kernels of the per-agent rules of the cops and criminals.
+
+The kernels work on the integer district raster and the sugar and risk
+arrays of the model, so they can be compiled. If Numba is installed they
+are compiled on their first call, otherwise they run as plain Python.
+Compiling all kernels takes several seconds. The result is cached in
+__pycache__ (or in NUMBA_CACHE_DIR), so only the first run in a new
+environment pays for it; warm_up compiles them up front:
+
+    python kernels.py
+Both give the same results as the rules they replace: the cells are
+visited in the order of grid.get_neighborhood and the utilities are
+computed with the same operations in the same order.
+
+criminal_turns runs the criminals of the array engine one after another.
+Without Numba the engine uses ArrayEngine.take_turns instead, which gives
+the same results as array operations.
+"""
+
+import math
+import time
+
+import numpy as np
+
+try:
+    from numba import njit
+    compiled = True
+except ImportError:
+    compiled = False
+
+    def njit(*args, **kwargs):
+        """
+        Returns the function as it is when Numba is not installed.
+        """
+        if args and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+@njit(cache=True)
+def min_sugar_cells(district_map, sugar, x, y, radius):
+    """
+    Returns the cells within radius of (x, y), without (x, y) itself,
+    that lie in the district of (x, y) and have the least sugar,
+    like Cop.move_to_crime. The sugar is compared as integers.
+    """
+    width, height = district_map.shape
+    district = district_map[x, y]
+    cells = np.empty(((2 * radius + 1) ** 2, 2), dtype=np.int64)
+    n_cells = 0
+    least = 0
+    for i in range(max(x - radius, 0), min(x + radius + 1, width)):
+        for j in range(max(y - radius, 0), min(y + radius + 1, height)):
+            if (i == x and j == y) or district_map[i, j] != district:
+                continue
+            amount = int(sugar[i, j])
+            if n_cells == 0 or amount < least:
+                least = amount
+                n_cells = 0
+            if amount == least:
+                cells[n_cells, 0] = i
+                cells[n_cells, 1] = j
+                n_cells += 1
+    return cells[:n_cells]
+
+
+@njit(cache=True)
+def step_towards_crime(district_map, x, y, target_x, target_y):
+    """
+    Returns the cell a cop on (x, y) moves to when heading for the target:
+    two cells along both axes, one at the border of the grid, and back
+    along the axis where it would cross into a neighbouring district.
+    """
+    width, height = district_map.shape
+    if x > target_x:
+        x_new = x - 2 if x - 2 >= 0 else x - 1
+    elif x < target_x:
+        x_new = x + 2 if x + 2 < width else x + 1
+    else:
+        x_new = x
+    if y > target_y:
+        y_new = y - 2 if y - 2 >= 0 else y - 1
+    elif y < target_y:
+        y_new = y + 2 if y + 2 < height else y + 1
+    else:
+        y_new = y
+
+    district = district_map[x, y]
+    new_district = district_map[x_new, y_new]
+    if (
+        new_district != district
+        and 1 <= x < width - 1 and 1 <= y < height - 1
+    ):
+        below = district_map[x, y - 1]
+        above = district_map[x, y + 1]
+        left = district_map[x - 1, y]
+        right = district_map[x + 1, y]
+        if below != district and below == new_district:
+            y_new = y
+        elif above != district and above == new_district:
+            y_new = y
+        elif left != district and left == new_district:
+            x_new = x
+        elif right != district and right == new_district:
+            x_new = x
+    return x_new, y_new
+
+
+@njit(cache=True)
+def best_cells(
+    wealth, risk, surveillance_map, centers, radius,
+    own_wealth, risk_aversion, a=1, c=0.3
+):
+    """
+    Returns the cells with the highest utility of a criminal and that
+    utility, like SugarscapeCg.evaluate_criminals. The candidates are the
+    cells within radius of the centers, the criminal's own position first
+    and then its buddies, and every cell is evaluated once.
+    """
+    width, height = wealth.shape
+    own_x = centers[0, 0]
+    own_y = centers[0, 1]
+    # if your own wealth is negative you're more likely to commit crimes
+    d = 0.5 if own_wealth < 0 else 0.01
+
+    size = (2 * radius + 1) ** 2
+    cells = np.empty((len(centers) * size, 2), dtype=np.int64)
+    utilities = np.empty(len(centers) * size)
+    n_cells = 0
+    for center in range(len(centers)):
+        x = centers[center, 0]
+        y = centers[center, 1]
+        for i in range(max(x - radius, 0), min(x + radius + 1, width)):
+            for j in range(max(y - radius, 0), min(y + radius + 1, height)):
+                # skip the cells of the neighborhoods already visited
+                seen = False
+                for other in range(center):
+                    if (
+                        abs(i - centers[other, 0]) <= radius
+                        and abs(j - centers[other, 1]) <= radius
+                    ):
+                        seen = True
+                        break
+                if seen:
+                    continue
+                distance = math.sqrt((i - own_x) ** 2 + (j - own_y) ** 2)
+                if distance < 2:
+                    distance = 0.0
+                utilities[n_cells] = (
+                    + a * wealth[i, j]
+                    - risk_aversion * surveillance_map[i, j] * risk[i, j]
+                    - c * distance
+                    - d * own_wealth
+                )
+                cells[n_cells, 0] = i
+                cells[n_cells, 1] = j
+                n_cells += 1
+
+    highest = utilities[:n_cells].max()
+    n_targets = 0
+    for index in range(n_cells):
+        if utilities[index] == highest:
+            cells[n_targets] = cells[index]
+            n_targets += 1
+    return cells[:n_targets], highest
+
+
+@njit(cache=True)
+def criminal_turns(
+    order, picks, x, y, wealth, risk_aversion, groups, members,
+    member_starts, member_counts, sugar, steps_since_crime, risk,
+    surveillance_map, radius, a=1, c=0.3
+):
+    """
+    Runs Criminal.step for the criminals of ArrayEngine.step_criminals one
+    after another, in order (flat indices). Every criminal chooses a cell
+    with the highest utility among the cells within radius of the members
+    of its buddy group, the one at picks of the way through those cells
+    in flat order, and moves there and robs it, or makes a step towards it.
+
+    Returns the flat index of the cell every criminal robbed, or -1.
+    """
+    n_replicates, width, height = sugar.shape
+    n_criminals = len(x) // n_replicates
+    visited = np.full(width * height, -1, dtype=np.int64)
+    cells = np.empty(width * height, dtype=np.int64)
+    utilities = np.empty(width * height)
+    robbed = np.full(len(order), -1, dtype=np.int64)
+
+    for turn in range(len(order)):
+        criminal = order[turn]
+        replicate = criminal // n_criminals
+        own_x = x[criminal]
+        own_y = y[criminal]
+        own_wealth = wealth[criminal]
+        # if your own wealth is negative you're more likely to commit crimes
+        d = 0.5 if own_wealth < 0 else 0.01
+
+        n_cells = 0
+        group = groups[criminal]
+        for member in members[
+            member_starts[group]:member_starts[group] + member_counts[group]
+        ]:
+            for i in range(
+                max(x[member] - radius, 0), min(x[member] + radius + 1, width)
+            ):
+                for j in range(
+                    max(y[member] - radius, 0),
+                    min(y[member] + radius + 1, height)
+                ):
+                    cell = i * height + j
+                    if visited[cell] == turn:
+                        continue
+                    visited[cell] = turn
+                    distance = math.sqrt((i - own_x) ** 2 + (j - own_y) ** 2)
+                    if distance < 2:
+                        distance = 0.0
+                    cells[n_cells] = cell
+                    utilities[n_cells] = (
+                        + a * sugar[replicate, i, j]
+                        - risk_aversion[criminal] * surveillance_map[i, j]
+                        * risk[replicate, i, j]
+                        - c * distance
+                        - d * own_wealth
+                    )
+                    n_cells += 1
+
+        highest = utilities[:n_cells].max()
+        targets = np.sort(cells[:n_cells][utilities[:n_cells] == highest])
+        target = targets[int(picks[turn] * len(targets))]
+        target_x = target // height
+        target_y = target % height
+
+        if abs(target_x - own_x) > radius or abs(target_y - own_y) > radius:
+            # move towards your buddy
+            x[criminal] = own_x + np.sign(target_x - own_x)
+            y[criminal] = own_y + np.sign(target_y - own_y)
+            continue
+        x[criminal] = target_x
+        y[criminal] = target_y
+        if sugar[replicate, target_x, target_y] > 0 and highest > 0:
+            wealth[criminal] += sugar[replicate, target_x, target_y]
+            sugar[replicate, target_x, target_y] = 0
+            steps_since_crime[replicate, target_x, target_y] = 2
+            robbed[turn] = target
+    return robbed
+
+
+def warm_up(steps=5):
+    """
+    Compiles the kernels, or loads them from the cache, by running a
+    short model with each engine, and returns the seconds it took.
+    Processes forked afterwards, like the workers of a sweep, inherit
+    the compiled kernels.
+    """
+    from model import SugarscapeCg
+
+    start = time.perf_counter()
+    if compiled:
+        for engine in ['objects', 'arrays']:
+            SugarscapeCg(seed=0, engine=engine).run_model(step_count=steps)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    if not compiled:
+        print('Numba is not installed, the kernels run as plain Python')
+    else:
+        print(f'Kernels ready in {warm_up():.1f} s')
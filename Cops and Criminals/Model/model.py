@@ -10,19 +10,24 @@ Northwestern University, Evanston, IL.
 """
 
 from itertools import count
+from collections import defaultdict
 from mesa import Model
-from mesa.space import MultiGrid
-from mesa.datacollection import DataCollector
 from sqlalchemy import true
 
-from agents import Sugar, Cop, Criminal
+from agents import SugarField, Cop, Criminal
 from schedule import RandomActivationByBreed
-
-import os
+from collector import ColumnarCollector
+from profiling import Profiler
+from city_map import load_city_map, district_centers
+from space import OccupancyGrid
+from array_engine import ArrayEngine
+import kernels
+
+import pickle
 import random
+import zlib
 import numpy as np
 
-base_path = os.path.dirname(os.path.abspath(__file__))
 
 class SugarscapeCg(Model):
     """
@@ -32,7 +37,6 @@ class SugarscapeCg(Model):
     verbose = False  # Print-monitoring
 
     n_cops = 0  
-    cops_that_stepped = 0
     distribution_changes = {
         'Centrum': 0, 
         'Nieuw-West': 0, 
@@ -65,30 +69,104 @@ class SugarscapeCg(Model):
     }
     districts_in_deficit = []
     districts_in_surplus = []
+    burn_in_period = 100
+    # number of cells of the city the initial populations are given for
+    reference_cells = 2500
+
+    # kinds of draws that can get their own random number generator
+    random_purposes = [
+        'placement', 
+        'wealth', 
+        'risk_aversion', 
+        'buddy_id', 
+        'schedule', 
+        'Criminal', 
+        'Cop'
+    ]
+
+    # district ids are the indices of this list
+    district_names = [
+        'Centrum', 
+        'Nieuw-West', 
+        'Noord', 
+        'Oost', 
+        'West', 
+        'Zuid', 
+        'Zuidoost', 
+        'Undefined'
+    ]
+    # initial wealth of the cells of each district in the map file
+    district_wealths = {
+        44.0: 'Centrum', 
+        29.0: 'Nieuw-West', 
+        28.0: 'Noord', 
+        37.0: 'Oost', 
+        36.0: 'West', 
+        49.0: 'Zuid', 
+        25.0: 'Zuidoost'
+    }
     
 
     def __init__(
-        self, height=50, width=50, initial_population_criminals=45, 
+        self, height=None, width=None, initial_population_criminals=45, 
         initial_population_cops=40, criminal_risk_radius=5, 
         cop_catch_radius=1, jail_sentence=10, 
-        criminal_risk_aversion=100, criminal_disconnectivity=45
+        criminal_risk_aversion=100, criminal_disconnectivity=45, seed=None,
+        agent_streams=False, common_random_numbers=False,
+        profile=False, profile_columns=False, map_file=None,
+        scale_populations=True, engine='objects'
     ):
         """
         Create a new Constant Growback model with the given parameters.
 
         Args:
+            height, width: Size of the grid, the map is resampled to it;
+                by default the resolution of the map file is used
             initial_population: Number of population to start with
+            seed: Seed of the model's random number generator, 
+                all randomness of a run is drawn from it
+            agent_streams: If True, criminals and cops draw from 
+                their own substreams of the model's generator
+            common_random_numbers: If True, every kind of draw has its own 
+                substream, so that runs with the same seed and different 
+                parameters share the draws their parameters do not affect
+            profile: If True, the time of every breed, of the hot methods
+                and of the data collection is recorded in self.profiler;
+                with the array engine its criminal and cop phases are
+                the breeds
+            profile_columns: If True, the step time of every breed
+                is also collected as a column
+            map_file: Path of the district raster, the 50x50 map
+                of Amsterdam by default
+            scale_populations: If True, the initial populations are
+                numbers per 50x50 city (reference_cells cells) and are
+                scaled with the number of cells of the map
+            engine: 'objects' to run the criminals and cops as agents on
+                the grid, 'arrays' to run them on the struct-of-arrays
+                ArrayEngine, which has the same outputs in distribution
         """
 
+        # Set up the random number generators
+        self.random = random.Random(seed)
+        self._seed = seed
+        self.agent_streams = agent_streams
+        self.common_random_numbers = common_random_numbers
+        self.build_random_streams()
+
         # Set parameters
-        self.height = height
-        self.width = width
-        self.initial_wealth_distribution = np.genfromtxt(
-            base_path + "/resources/amsterdam50x50new.txt"
+        self.initial_wealth_distribution = load_city_map(
+            map_file, width, height
         )
+        self.width, self.height = self.initial_wealth_distribution.shape
+        self.build_district_index()
 
         self.initial_population_criminals = initial_population_criminals
         self.initial_population_cops = initial_population_cops
+        self.population_scale = 1
+        if scale_populations:
+            self.population_scale = (
+                len(self.valid_cells) / self.reference_cells
+            )
 
         self.criminal_risk_radius = criminal_risk_radius
         self.criminal_risk_aversion = criminal_risk_aversion
@@ -98,125 +176,78 @@ class SugarscapeCg(Model):
         self.jail_sentence = jail_sentence
 
         self.schedule = RandomActivationByBreed(self)
-        self.grid = MultiGrid(self.height, self.width, torus=False)
-        self.datacollector = DataCollector(
-            {
-            "Criminal Wealth": 
-            lambda m: 
-            m.schedule.get_breed_count(),
-
-            "Criminal Count": 
-            lambda m: 
-            m.schedule.get_criminal_count(),
-
-            "Criminal in Jail Count": 
-            lambda m:
-            m.schedule.get_criminal_count_in_jail(),
-
-            "Crimes commited": 
-            lambda m:
-            m.schedule.get_crimes_commited(),
-
-            "Centrum": 
-            lambda m:
-            m.schedule.get_crimes_per_timestep().get("Centrum"),
-
-            "Noord": 
-            lambda m:
-            m.schedule.get_crimes_per_timestep().get("Noord"),
-
-            "West": 
-            lambda m:
-            m.schedule.get_crimes_per_timestep().get("West"),
-
-            "Zuid": 
-            lambda m:
-            m.schedule.get_crimes_per_timestep().get("Zuid"),
-
-            "Zuidoost": 
-            lambda m:
-            m.schedule.get_crimes_per_timestep().get("Zuidoost"),
-
-            "Oost": 
-            lambda m:
-            m.schedule.get_crimes_per_timestep().get("Oost"),
-
-            "Nieuw-West": 
-            lambda m:
-            m.schedule.get_crimes_per_timestep().get("Nieuw-West"),
-
-            "Centrum_Avg": 
-            lambda m:
-            m.schedule.update_average_crimes_per_timestep("Centrum").get("Centrum"),
-
-            "Noord_Avg": 
-            lambda m:
-            m.schedule.update_average_crimes_per_timestep("Noord").get("Noord"),
-
-            "West_Avg": 
-            lambda m:
-            m.schedule.update_average_crimes_per_timestep("West").get("West"),
-
-            "Zuid_Avg": 
-            lambda m:
-            m.schedule.update_average_crimes_per_timestep("Zuid").get("Zuid"),
-
-            "Zuidoost_Avg": 
-            lambda m:
-            m.schedule.update_average_crimes_per_timestep("Zuidoost").get("Zuidoost"),
-
-            "Oost_Avg": 
-            lambda m:
-            m.schedule.update_average_crimes_per_timestep("Oost").get("Oost"),
-
-            "Nieuw-West_Avg": 
-            lambda m:
-            m.schedule.update_average_crimes_per_timestep("Nieuw-West").get("Nieuw-West")
-            }
+        self.schedule.breed_phases[Cop] = 'redistribute_cops'
+        self.grid = OccupancyGrid(
+            self.width, 
+            self.height, 
+            torus=False, 
+            breeds=(Cop, Criminal), 
+            regions=self.district_map
         )
-
-        self.total_crimes_per_district = {
-            'Centrum': 0, 
-            'Nieuw-West': 0, 
-            'Noord': 0, 
-            'Oost': 0, 
-            'West': 0, 
-            'Zuid': 0, 
-            'Zuidoost': 0, 
-            'Undefined': 0
-        }
-
-        # Create sugar
-        sugar_distribution = np.genfromtxt(
-            base_path + "/resources/amsterdam50x50new.txt"
+        # criminals that did a crime this step and are not caught, per cell
+        self.crime_occupancy = np.zeros((self.width, self.height), dtype=int)
+        self.buddy_groups = defaultdict(list)
+        self.window_offsets = {}
+        self.cops = []
+
+        self.profiler = None
+        extra_reporters = {}
+        if profile or profile_columns:
+            self.profiler = Profiler(self)
+            if profile_columns:
+                extra_reporters = self.profiler.get_column_reporters()
+        self.datacollector = ColumnarCollector(
+            extra_reporters=extra_reporters
+        )
+        if self.profiler is not None:
+            self.profiler.instrument_collector(self.datacollector)
+        # diagnostic of the last run_model with a convergence monitor
+        self.convergence = None
+
+        self.average_crimes_per_district = np.zeros(len(self.district_names))
+        self.crimes_per_district_step = np.zeros(
+            len(self.district_names), dtype=int
         )
-        for _, x, y in self.grid.coord_iter():
-            max_sugar = sugar_distribution[x, y]
-            sugar = Sugar((x, y), self, max_sugar, steps_since_crime=0)
-            self.grid.place_agent(sugar, (x, y))
-            self.schedule.add(sugar)
-
-        # Create agents
-        for i in range(self.initial_population_criminals):
+        self.crimes_per_district_cumulative = np.zeros(
+            len(self.district_names), dtype=int
+        )
+
+        # Create sugar, the array engine holds its own
+        self.sugar = None
+        if engine == 'objects':
+            self.sugar = SugarField(self.initial_wealth_distribution)
+
+        # Create agents, or their initial state for the array engine
+        if engine not in ('objects', 'arrays'):
+            raise ValueError(f"Unknown engine {engine!r}")
+        self.array_engine = None
+        criminal_states = []
+        cop_positions = []
+        n_criminals = self.scale_population(self.initial_population_criminals)
+        for i in range(n_criminals):
             # get the parameters for this criminal
-            while(True):
-                x = self.random.randrange(self.width)
-                y = self.random.randrange(self.height)
-                if(self.get_district((x,y)) != "Undefined"):
-                    break
-            wealth = self.random.randrange(6, 25)
+            x, y = self.random_valid_cell()
+            wealth = self.random_streams['wealth'].randrange(6, 25)
             if self.criminal_risk_aversion == 0:
                 risk_aversion = 0
             else:
-                risk_aversion = self.random.randrange(
-                    0, self.criminal_risk_aversion
-                )
+                risk_aversion = self.random_streams[
+                    'risk_aversion'
+                ].randrange(0, self.criminal_risk_aversion)
 
             if self.criminal_disconnectivity == 0:
                 buddy_id = 0
             else:
-                buddy_id=random.randint(0, self.criminal_disconnectivity)
+                buddy_id = self.random_streams['buddy_id'].randint(
+                    0, self.criminal_disconnectivity
+                )
             
+            if engine == 'arrays':
+                criminal_states.append(
+                    (x, y, wealth, risk_aversion, buddy_id)
+                )
+                continue
+
             # create the criminal
             criminal = Criminal(
                 (x, y), 
@@ -227,16 +258,18 @@ class SugarscapeCg(Model):
                 risk_aversion=risk_aversion, 
                 risk_radius=self.criminal_risk_radius
             )
-            self.grid.place_agent(criminal, (x, y))
-            self.schedule.add(criminal)
+            self.add_agent(criminal, (x, y))
         
-        for i in range(self.initial_population_cops):
+        n_cops = self.scale_population(self.initial_population_cops)
+        for i in range(n_cops):
             # get the parameters for this cop
-            while(True):
-                x = self.random.randrange(self.width)
-                y = self.random.randrange(self.height)
-                if(self.get_district((x,y)) != "Undefined"):
-                    break
+            x, y = self.random_valid_cell()
+            self.n_cops +=1
+            if engine == 'arrays':
+                # draw the id every Cop draws, so the placement is the same
+                self.random_streams['Cop'].random()
+                cop_positions.append((x, y))
+                continue
 
             # create the cop
             cop = Cop(
@@ -245,9 +278,22 @@ class SugarscapeCg(Model):
                 catch_radius=self.cop_catch_radius, 
                 jail_sentence=self.jail_sentence
             )
-            self.grid.place_agent(cop, (x, y))
-            self.schedule.add(cop)
-            self.n_cops +=1
+            self.add_agent(cop, (x, y))
+
+        self.risk_kernel = self.build_risk_kernel(self.criminal_risk_radius)
+        self.criminal_plans = {}
+        if engine == 'arrays':
+            self.array_engine = ArrayEngine(
+                self, 
+                [criminal_states], 
+                [cop_positions], 
+                [self.random.getrandbits(128)]
+            )
+            if self.profiler is not None:
+                self.profiler.instrument_engine(self.array_engine)
+            self.link_array_engine()
+        else:
+            self.update_risk_field()
 
         self.running = True
         self.datacollector.collect(self)
@@ -256,14 +302,36 @@ class SugarscapeCg(Model):
         """
         Advances the model one step and collects the data.
         """
+        if self.array_engine is not None:
+            self.array_engine.step()
+            self.schedule.steps += 1
+            self.schedule.time += 1
+            self.datacollector.collect(self)
+            return
+
+        self.crimes_per_district_step[:] = 0
+        self.crime_occupancy[:] = 0
+        self.sugar.step()
+        self.update_risk_field()
+        # criminals step before the cops, so they can be planned up front,
+        # the compiled kernel evaluates a criminal faster than a plan
+        if not kernels.compiled:
+            self.plan_criminal_moves()
         self.schedule.step()
         self.datacollector.collect(self)
         if self.verbose:
             print([self.schedule.time, self.schedule.get_breed_count()])
 
-    def run_model(self, step_count=300):
-        """
-        Runs the model step by step.
+    def run_model(self, step_count=300, convergence=None):
+        """Runs the model step by step.
+
+        :param step_count: number of steps, or the maximum number of steps
+            if convergence is given
+        :type step_count: int
+        :param convergence: monitor that stops the run once the district
+            averages have converged, see convergence.py. Its diagnostic 
+            is kept in ``self.convergence``
+        :type convergence: ConvergenceMonitor or None
         """
 
         if self.verbose:
@@ -272,8 +340,21 @@ class SugarscapeCg(Model):
                 self.schedule.get_breed_count(),
             )
 
+        self.datacollector.reserve(
+            self.datacollector.n_rows + step_count
+        )
         for i in range(step_count):
             self.step()
+            if convergence is not None and convergence.check(self):
+                break
+
+        if convergence is not None:
+            if (
+                convergence.diagnostic is None 
+                or convergence.diagnostic['stop_step'] != self.schedule.time
+            ):
+                convergence.diagnostic = convergence.diagnose(self)
+            self.convergence = convergence.diagnostic
 
         if self.verbose:
             print("")
@@ -282,6 +363,484 @@ class SugarscapeCg(Model):
                 self.schedule.get_breed_count(),
             )
 
+    def add_agent(self, agent, pos):
+        """Place an agent on the grid and add it to the schedule.
+ 
+        :param agent: agent to be added
+        :type agent: Cop or Criminal
+        :param pos: position
+        :type pos: tuple of ints (x, y)
+        """
+        self.grid.place_agent(agent, pos)
+        self.schedule.add(agent)
+        if type(agent) is Criminal:
+            self.buddy_groups[agent.buddy_id].append(agent)
+        elif type(agent) is Cop:
+            self.cops.append(agent)
+        if self.profiler is not None:
+            self.profiler.instrument(agent)
+
+    def remove_agent(self, agent):
+        """Remove an agent from the grid and the schedule.
+ 
+        :param agent: agent to be removed
+        :type agent: Cop or Criminal
+        """
+        self.grid.remove_agent(agent)
+        self.schedule.remove(agent)
+        if type(agent) is Criminal:
+            self.buddy_groups[agent.buddy_id].remove(agent)
+        elif type(agent) is Cop:
+            self.cops.remove(agent)
+
+    def get_buddy_positions(self, criminal):
+        """Get the positions of the buddies of a criminal.
+
+        The members of a buddy group are looked up in ``buddy_groups``, 
+        so their positions are always the current ones.
+ 
+        :param criminal: criminal whose buddies are looked up
+        :type criminal: Criminal
+        
+        :rtype: list of tuples of ints (x, y)
+        :return: distinct positions of the criminals with the same buddy_id,
+            other than the criminal's own position, in grid order
+        """
+        return sorted({
+            buddy.pos 
+            for buddy in self.buddy_groups[criminal.buddy_id] 
+            if buddy.pos != criminal.pos
+        })
+
+    def __getstate__(self):
+        """
+        Returns the full state of the model for pickling, 
+        including the state of the random number generators.
+        """
+        state = self.__dict__.copy()
+        state['random'] = self.random.getstate()
+        state['random_streams'] = {
+            purpose: None if stream is self.random else stream.getstate()
+            for purpose, stream in self.random_streams.items()
+        }
+        state['criminal_plans'] = {}
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores the full state of the model from __getstate__.
+        """
+        state = state.copy()
+        self.random = random.Random()
+        self.random.setstate(state.pop('random'))
+        self.random_streams = {}
+        for purpose, stream_state in state.pop('random_streams').items():
+            if stream_state is None:
+                self.random_streams[purpose] = self.random
+            else:
+                self.random_streams[purpose] = random.Random()
+                self.random_streams[purpose].setstate(stream_state)
+        self.__dict__.update(state)
+        if self.array_engine is not None:
+            self.link_array_engine()
+
+    def snapshot(self):
+        """
+        Returns a compact snapshot of the full state of the model: the grid,
+        the agents, the random number generator states, the counters and 
+        the collected data.
+        """
+        self.grid._neighborhood_cache.clear()
+        if self.array_engine is not None:
+            self.array_engine.reset_neighborhoods()
+        return zlib.compress(pickle.dumps(self, pickle.HIGHEST_PROTOCOL))
+
+    @classmethod
+    def restore(cls, snapshot):
+        """
+        Returns the model stored in a snapshot, 
+        which continues exactly as the original would have.
+        """
+        return pickle.loads(zlib.decompress(snapshot))
+
+    @classmethod
+    def fork(cls, snapshot, seed):
+        """
+        Returns the model stored in a snapshot with its random number 
+        generators reseeded, so that replicates can be branched off 
+        a single burn-in.
+        """
+        model = cls.restore(snapshot)
+        model.reset_randomizer(seed)
+        model.build_random_streams()
+        if model.array_engine is not None:
+            model.array_engine.reseed([model.random.getrandbits(128)])
+        return model
+
+    def link_array_engine(self):
+        """
+        Makes the crime counters of the model views of the
+        first replicate of the array engine.
+        """
+        engine = self.array_engine
+        self.crimes_per_district_step = engine.crimes_per_district_step[0]
+        self.crimes_per_district_cumulative = (
+            engine.crimes_per_district_cumulative[0]
+        )
+        self.average_crimes_per_district = (
+            engine.average_crimes_per_district[0]
+        )
+
+    def build_random_streams(self):
+        """
+        Sets up ``random_streams``, the generator used for every kind of 
+        draw. By default all of them are ``self.random``. The substreams 
+        of agent_streams and common_random_numbers are seeded from 
+        ``self.random``, so a run is reproduced by its seed alone.
+        """
+        if self.common_random_numbers:
+            own_streams = self.random_purposes
+        elif self.agent_streams:
+            own_streams = ['Criminal', 'Cop']
+        else:
+            own_streams = []
+
+        entropy = self.random.getrandbits(128) if own_streams else 0
+        self.random_streams = {}
+        for index, purpose in enumerate(self.random_purposes):
+            if purpose in own_streams:
+                stream_seed = np.random.SeedSequence(
+                    entropy, spawn_key=(index,)
+                ).generate_state(4)
+                self.random_streams[purpose] = random.Random(
+                    int.from_bytes(stream_seed.tobytes(), 'little')
+                )
+            else:
+                self.random_streams[purpose] = self.random
+
+    def get_window_offsets(self, radius):
+        """Get the (dx, dy) offsets of a Moore window, sorted like the grid.
+ 
+        :param radius: radius of the window
+        :type radius: int
+        
+        :rtype: tuple of two numpy arrays of ints
+        :return: the dx and the dy of every cell in the window
+        """
+        if radius not in self.window_offsets:
+            offsets = np.arange(-radius, radius + 1)
+            dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+            self.window_offsets[radius] = dx.ravel(), dy.ravel()
+        return self.window_offsets[radius]
+
+    def build_risk_kernel(self, radius):
+        """Get the weights with which a cop adds to the risk of a cell.
+ 
+        :param radius: radius in which criminals look for cops
+        :type radius: int
+        
+        :rtype: numpy array of shape (2 * radius + 1, 2 * radius + 1)
+        :return: 1 / distance for every offset in the Moore window,
+            0 for the center (a cop on the cell itself is handled separately)
+        """
+        offsets = np.arange(-radius, radius + 1)
+        dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+        distance = np.sqrt(dx ** 2 + dy ** 2)
+        distance[radius, radius] = np.inf
+        return 1 / distance
+
+    def update_risk_field(self):
+        """Compute the risk criminals perceive on every cell.
+
+        The cop occupancy layer of the grid is convolved with the risk kernel,
+        and cells with a cop on them get a risk of 100. Cops only move 
+        after all criminals have stepped, so it is computed once per step.
+        """
+        occupancy = self.grid.occupancy[Cop]
+        radius = len(self.risk_kernel) // 2
+        padded = np.pad(occupancy, radius)
+        risk_field = np.zeros(occupancy.shape)
+        # add the window offsets in the order the grid lists the neighbors
+        for i, j in zip(*np.nonzero(self.risk_kernel)):
+            risk_field += self.risk_kernel[i, j] * padded[
+                i:i + occupancy.shape[0], 
+                j:j + occupancy.shape[1]
+            ]
+        risk_field[occupancy > 0] = 100
+        self.risk_field = risk_field
+
+    def plan_criminal_moves(self):
+        """
+        Evaluates the candidate cells of all active criminals in one pass.
+        """
+        criminals = [
+            criminal 
+            for criminal in self.schedule.agents_by_breed[Criminal].values() 
+            if criminal.jail_time == 0
+        ]
+        self.criminal_plans = {}
+        radii = {criminal.search_radius for criminal in criminals}
+        for radius in radii:
+            self.criminal_plans.update(self.evaluate_criminals(
+                [c for c in criminals if c.search_radius == radius], radius
+            ))
+
+    def get_criminal_targets(self, criminal):
+        """Get the cells with the highest utility for a criminal.
+
+        The planned evaluation is used if the buddies of the criminal 
+        have not moved and none of its candidate cells have been robbed 
+        since, otherwise the criminal is evaluated again. If the kernels
+        are compiled, the criminal is always evaluated by kernels.best_cells.
+ 
+        :param criminal: criminal that is about to move
+        :type criminal: Criminal
+        
+        :rtype: tuple (list of tuples of ints (x, y), float)
+        :return: cells with the highest utility in the order 
+            they were evaluated, and the highest utility
+        """
+        if kernels.compiled:
+            centers = np.array(
+                [criminal.pos] + self.get_buddy_positions(criminal)
+            )
+            cells, highest = kernels.best_cells(
+                self.sugar.amount,
+                self.risk_field,
+                self.surveillance_map,
+                centers,
+                criminal.search_radius,
+                criminal.wealth,
+                criminal.risk_aversion
+            )
+            return list(map(tuple, cells.tolist())), highest
+
+        plan = self.criminal_plans.pop(criminal, None)
+        if plan is not None:
+            buddy_positions, x, y, wealth, possible_targets, highest = plan
+            if (
+                buddy_positions == self.get_buddy_positions(criminal)
+                and np.array_equal(self.sugar.amount[x, y], wealth)
+            ):
+                return possible_targets, highest
+
+        plan = self.evaluate_criminals([criminal], criminal.search_radius)
+        return plan[criminal][4:]
+
+    def evaluate_criminals(self, criminals, radius, a=1, c=0.3):
+        """Evaluate the utility of the candidate cells of many criminals.
+
+        Applies the rule of Criminal.get_utility to the own neighborhood 
+        and the neighborhoods of the buddies of every criminal at once.
+ 
+        :param criminals: criminals to evaluate
+        :type criminals: list of Criminal
+        :param radius: search radius of the criminals
+        :type radius: int
+        
+        :rtype: dict
+        :return: dictionary with the criminals as keys and tuples of the 
+            buddy positions, the x and y of the candidate cells, their 
+            wealth, the cells with the highest utility 
+            and the highest utility as values
+        """
+        if not criminals:
+            return {}
+
+        # centers of the neighborhoods, own position first
+        buddy_positions = []
+        centers = []
+        owners = []
+        for index, criminal in enumerate(criminals):
+            buddies = self.get_buddy_positions(criminal)
+            buddy_positions.append(buddies)
+            centers.append(criminal.pos)
+            centers.extend(buddies)
+            owners.extend([index] * (len(buddies) + 1))
+        centers = np.array(centers)
+
+        # Moore neighborhoods in the order of grid.get_neighborhood
+        dx, dy = self.get_window_offsets(radius)
+        x = (centers[:, 0, None] + dx).ravel()
+        y = (centers[:, 1, None] + dy).ravel()
+        owner = np.repeat(owners, dx.size)
+        inside = (
+            (x >= 0) & (x < self.grid.width) 
+            & (y >= 0) & (y < self.grid.height)
+        )
+        x, y, owner = x[inside], y[inside], owner[inside]
+
+        # keep the first occurrence of every cell of a criminal
+        keys = (owner * self.grid.width + x) * self.grid.height + y
+        first = np.sort(np.unique(keys, return_index=True)[1])
+        x, y, owner = x[first], y[first], owner[first]
+
+        own_x = np.array([criminal.pos[0] for criminal in criminals])[owner]
+        own_y = np.array([criminal.pos[1] for criminal in criminals])[owner]
+        own_wealth = np.array(
+            [criminal.wealth for criminal in criminals]
+        )[owner]
+        b = np.array(
+            [criminal.risk_aversion for criminal in criminals]
+        )[owner]
+
+        wealth = self.sugar.amount[x, y]
+        risk = self.risk_field[x, y]
+        distance = np.sqrt((x - own_x) ** 2 + (y - own_y) ** 2)
+        distance[distance < 2] = 0
+        district_risk = self.surveillance_map[x, y]
+        # if your own wealth is negative you're more likely to commit crimes
+        d = np.where(own_wealth < 0, 0.5, 0.01)
+
+        utility = (
+            + a * wealth 
+            - b * district_risk * risk 
+            - c * distance 
+            - d * own_wealth
+        )
+
+        starts = np.flatnonzero(np.diff(owner, prepend=-1))
+        ends = np.append(starts[1:], len(owner))
+        highest = np.maximum.reduceat(utility, starts)
+        is_target = utility == highest[owner]
+
+        plans = {}
+        for index, criminal in enumerate(criminals):
+            start, end = starts[index], ends[index]
+            targets = np.flatnonzero(is_target[start:end]) + start
+            plans[criminal] = (
+                buddy_positions[index],
+                x[start:end],
+                y[start:end],
+                wealth[start:end],
+                list(zip(x[targets].tolist(), y[targets].tolist())),
+                highest[index]
+            )
+        return plans
+
+    def build_district_index(self):
+        """Compile the map into an integer district raster.
+
+        Sets ``district_ids`` (name to id), ``district_map`` (id of every 
+        cell), ``district_cells`` (array of the (x, y) cells of every 
+        district id), ``valid_cells`` (all cells inside a district) and
+        ``district_centers`` (the center cell of every district).
+        """
+        self.district_ids = {
+            name: i for i, name in enumerate(self.district_names)
+        }
+        self.undefined_id = self.district_ids['Undefined']
+        self.district_map = np.full(
+            self.initial_wealth_distribution.shape, self.undefined_id
+        )
+        for wealth, name in self.district_wealths.items():
+            self.district_map[
+                self.initial_wealth_distribution == wealth
+            ] = self.district_ids[name]
+
+        self.district_cells = [
+            np.argwhere(self.district_map == district_id)
+            for district_id in range(len(self.district_names))
+        ]
+        self.valid_cells = np.argwhere(self.district_map != self.undefined_id)
+        self.district_centers = {
+            self.district_names[district_id]: center
+            for district_id, center in enumerate(
+                district_centers(self.district_cells)
+            )
+            if center is not None and district_id != self.undefined_id
+        }
+        self.surveillance_map = np.array([
+            self.surveillance_levels[name] for name in self.district_names
+        ])[self.district_map]
+
+        # districts present on the map, in the order they appear on the grid
+        present_ids, first_cells = np.unique(
+            self.district_map, return_index=True
+        )
+        self.district_order_ids = present_ids[np.argsort(first_cells)]
+        self.district_order = [
+            self.district_names[district_id] 
+            for district_id in self.district_order_ids
+        ]
+
+    def redistribute_cops(self):
+        """Decide how many cops every district gains or loses this step.
+
+        Runs once per step, after the criminals and before the cops step.
+        The districts in surplus and in deficit are derived from the crimes
+        of this step and the cops in every district, which are counted by
+        the grid as cops cross district borders.
+        """
+        changes = self.distribute_cops(
+            self.crimes_per_district_step[self.district_order_ids], 
+            self.grid.region_occupancy[Cop][self.district_order_ids]
+        )
+        self.distribution_changes = dict(
+            zip(self.district_order, changes.tolist())
+        )
+        self.made_changes = {
+            'Centrum': 0, 
+            'Nieuw-West': 0, 
+            'Noord': 0, 
+            'Oost': 0, 
+            'West': 0, 
+            'Westpoort': 0, 
+            'Zuid': 0, 
+            'Zuidoost': 0, 
+            'Undefined': 0
+        }
+        self.districts_in_deficit = [
+            district 
+            for district, balance in self.distribution_changes.items() 
+            if balance > 0
+        ]
+        self.districts_in_surplus = [
+            district 
+            for district, balance in self.distribution_changes.items() 
+            if balance < 0
+        ]
+
+    def distribute_cops(self, crimes, cops):
+        """Allocate the cops to the districts in proportion to their crimes.
+
+        The cops are divided by largest remainder: every district gets the
+        whole part of its share, and the cops left go to the districts with
+        the largest remainders, ties in district order.
+
+        :param crimes: crimes of this step in every district, 
+            or a (replicate, district) array
+        :type crimes: numpy array of ints
+        :param cops: cops in every district, shaped like crimes
+        :type cops: numpy array of ints
+
+        :rtype: numpy array of ints
+        :return: number of cops every district gains (or loses, if negative)
+        """
+        total_crime = crimes.sum(axis=-1, keepdims=True)
+        shares = self.n_cops * crimes / np.maximum(total_crime, 1)
+        targets = np.floor(shares).astype(int)
+        cops_left = self.n_cops - targets.sum(axis=-1, keepdims=True)
+        # rank of the remainder of every district, largest first
+        ranks = np.argsort(
+            np.argsort(targets - shares, axis=-1, kind='stable'), 
+            axis=-1, 
+            kind='stable'
+        )
+        targets += ranks < cops_left
+        return np.where(total_crime > 0, targets - cops, 0)
+
+    def scale_population(self, population):
+        """Scale an initial population to the number of cells of the map.
+
+        :param population: number of agents in a 50x50 city
+        :type population: int
+
+        :rtype: int
+        :return: number of agents on the map
+        """
+        return round(population * self.population_scale)
+
     def get_district(self, pos):
         """Get respective district of an input position.
  
@@ -291,27 +850,54 @@ class SugarscapeCg(Model):
         :rtype: string
         :return: district name
         """
-        x = pos[0]
-        y = pos[1]
-
-        initial_wealth = self.initial_wealth_distribution[x][y]
-
-        if initial_wealth == 28.0:
-            return 'Noord'
-        elif initial_wealth == 29.0:
-            return 'Nieuw-West'
-        elif initial_wealth == 36.0:
-            return 'West'
-        elif initial_wealth == 44.0:
-            return 'Centrum'
-        elif initial_wealth == 37.0:
-            return 'Oost'
-        elif initial_wealth == 49.0:
-            return 'Zuid'
-        elif initial_wealth == 25.0:
-            return 'Zuidoost'
-        else:
-            return 'Undefined'
+        return self.district_names[self.district_map[pos]]
+
+    def get_district_ids(self, positions):
+        """Get the district ids of many positions at once.
+ 
+        :param positions: positions
+        :type positions: array-like of shape (n, 2)
+        
+        :rtype: numpy array of ints
+        :return: district id of every position
+        """
+        positions = np.asarray(positions).reshape(-1, 2)
+        return self.district_map[positions[:, 0], positions[:, 1]]
+
+    def random_valid_cell(self):
+        """Draw a random position that lies within a district.
+        
+        :rtype: tuple of ints (x, y)
+        :return: position
+        """
+        index = self.random_streams['placement'].randrange(
+            len(self.valid_cells)
+        )
+        x, y = self.valid_cells[index]
+        return int(x), int(y)
+
+    def get_criminal_totals(self):
+        """Get the totals of the criminals that the collector reports.
+
+        :rtype: tuple of numbers
+        :return: total wealth, number of criminals, number of criminals 
+            in jail and total number of crimes
+        """
+        if self.array_engine is not None:
+            return tuple(
+                total[0] for total in self.array_engine.get_criminal_totals()
+            )
+
+        wealth = 0
+        in_jail = 0
+        crimes = 0
+        for agent in self.schedule.agents:
+            if type(agent) is Criminal:
+                wealth += agent.wealth
+                crimes += agent.crimes_commited
+                if agent.jail_time > 0:
+                    in_jail += 1
+        return wealth, self.schedule.get_criminal_count(), in_jail, crimes
 
     def get_agents_per_district(self, agent_type):
         """Get count of agents per district.
@@ -323,52 +909,95 @@ class SugarscapeCg(Model):
         :return: dictionary with district names as keys 
             and respective counts of agent_type
         """
-        districts_dict = {}
-        
-        for agents, x, y in self.grid.coord_iter():
-            district = self.get_district((x, y))
-            if district not in districts_dict.keys():
-                districts_dict[district] = 0
-            for agent in agents:
-                if type(agent) is agent_type:
-                    districts_dict[district] += 1
-
-        return districts_dict
+        counts = self.grid.region_occupancy[agent_type]
+        return {
+            district: int(counts[self.district_ids[district]])
+            for district in self.district_order
+        }
 
     
+    def record_crime(self, pos):
+        """Count a crime in the district of the position it was committed on,
+        and mark the criminal on it as catchable in ``crime_occupancy``.
+
+        :param pos: position of the crime
+        :type pos: tuple of ints (x, y)
+        """
+        district_id = self.district_map[pos]
+        self.crimes_per_district_step[district_id] += 1
+        self.crimes_per_district_cumulative[district_id] += 1
+        self.crime_occupancy[pos] += 1
+
     def get_crimes_per_district(self):
-        """Get count of crimes per district.
+        """Get count of crimes per district in the current step.
         
         :rtype: dict
         :return: dictionary with district names as keys 
             and respective counts of crimes
         """
-        districts_crimes_dict = {}
-        for agents, x, y in self.grid.coord_iter():
-            district = self.get_district((x, y))
-            if district not in districts_crimes_dict.keys():
-                districts_crimes_dict[district] = 0
-            for agent in agents:
-                if type(agent) is Criminal:
-                    if agent.does_crime:
-                        districts_crimes_dict[district] += 1   
-
-        return districts_crimes_dict
+        return {
+            district: int(
+                self.crimes_per_district_step[self.district_ids[district]]
+            )
+            for district in self.district_order
+        }
+
+    def get_cumulative_crimes_per_district(self):
+        """Get count of all crimes per district since the start of the run.
+        
+        :rtype: dict
+        :return: dictionary with district names as keys 
+            and respective counts of crimes
+        """
+        return {
+            district: int(
+                self.crimes_per_district_cumulative[
+                    self.district_ids[district]
+                ]
+            )
+            for district in self.district_order
+        }
     
+    @property
+    def total_crimes_per_district(self):
+        """Get the average crimes per step of every district 
+        after the burn in period.
+        
+        :rtype: dict
+        :return: dictionary with district names as keys 
+            and respective average crimes
+        """
+        return dict(zip(self.district_names, self.average_crimes_per_district))
+
+    def update_average_crimes(self):
+        """ 
+        Updates the average crimes of all districts at every step 
+        after the burn in period.
+        """
+        burn_in_period = self.burn_in_period
+        if self.schedule.time > burn_in_period:
+            self.average_crimes_per_district *= (
+                (self.schedule.time-1) - burn_in_period
+            )
+            self.average_crimes_per_district += self.crimes_per_district_step
+            self.average_crimes_per_district /= (
+                (self.schedule.time) - burn_in_period
+            )
+
     def update_average_crimes_per_district(self,district):
         """ 
         Updates the average crimes dict at every step after the burn in period.
         """
-        burn_in_period = 100
+        burn_in_period = self.burn_in_period
         if self.schedule.time > burn_in_period:
-            crimes_current_step = self.get_crimes_per_district()
-            self.total_crimes_per_district[district] *= (
+            district_id = self.district_ids[district]
+            self.average_crimes_per_district[district_id] *= (
                 (self.schedule.time-1) - burn_in_period
             )
-            self.total_crimes_per_district[district] += (
-                crimes_current_step[district]
+            self.average_crimes_per_district[district_id] += (
+                self.crimes_per_district_step[district_id]
             )
-            self.total_crimes_per_district[district] /= (
+            self.average_crimes_per_district[district_id] /= (
                 (self.schedule.time) - burn_in_period
             )
-        return self.total_crimes_per_district
\ No newline at end of file
+        return self.total_crimes_per_district
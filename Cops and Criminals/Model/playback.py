@@ -0,0 +1,301 @@
+"""
+Server that simulates ahead of the browser into a buffer of frames.
+
+With ModularServer every step of the model runs inside the request of the
+browser for the next frame, so the speed of the visualization is capped
+by the round trip and a slow step stalls the page. BufferedServer runs
+the model in a background thread, up to `ahead` steps beyond the furthest
+step a browser asked for, and keeps the frames of the last `history`
+steps. The browser plays them at its own rate with the Start, Stop and
+Step buttons, and the slider of PlaybackControl seeks to any buffered
+step without running the model again.
+
+Elements with a get_state method, like canvas.DeltaCanvasGrid, are kept
+as states and encoded for every browser from the step it shows. The
+frames of the other elements, like the charts, are kept as they are.
+Both are kept for the last `history` steps only, so after a seek the
+charts are drawn again from the first buffered step.
+
+Usage from the Model folder:
+
+    python run.py --buffered
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from mesa.visualization.ModularVisualization import (
+    ModularServer, SocketHandler, VisualizationElement
+)
+import tornado.escape
+
+
+class PlaybackControl(VisualizationElement):
+    """
+    Slider over the buffered steps, which seeks to the chosen step.
+    """
+    local_includes = ["PlaybackModule.js"]
+    js_code = "elements.push(new PlaybackModule());"
+
+    def render(self, model):
+        # the frames are made by the server, which knows the buffer
+        return None
+
+
+class FrameBuffer:
+    """
+    The states of the elements with a get_state method and the frames
+    of the other elements of the last capacity steps of a run.
+    """
+
+    def __init__(self, capacity):
+        self.steps = deque(maxlen=capacity)
+        self.count = 0
+
+    @property
+    def first(self):
+        """
+        Returns the first step in the buffer.
+        """
+        return self.count - len(self.steps)
+
+    @property
+    def last(self):
+        """
+        Returns the last step in the buffer, -1 if it is empty.
+        """
+        return self.count - 1
+
+    def append(self, states, series):
+        self.steps.append((states, series))
+        self.count += 1
+
+    def __contains__(self, step):
+        return step is not None and self.first <= step <= self.last
+
+    def get_states(self, step):
+        return self.steps[step - self.first][0]
+
+    def get_series(self, step):
+        return self.steps[step - self.first][1]
+
+
+class BufferedSocketHandler(SocketHandler):
+    """
+    Serves the frames of the buffer, and keeps the step the browser
+    shows so the canvas only gets the difference.
+    """
+
+    def open(self):
+        self.step = None
+        super().open()
+
+    def send_step(self, step):
+        self.write_message({
+            "type": "viz_state",
+            "data": self.application.get_frames(step, self.step)
+        })
+        self.step = step
+
+    async def on_message(self, message):
+        application = self.application
+        msg = tornado.escape.json_decode(message)
+
+        if msg["type"] == "get_step":
+            # a browser that fell behind the history goes on
+            # from its first step
+            step = max(msg["step"], application.buffer.first)
+            application.want(step)
+            await application.wait_for(step)
+            if step not in application.buffer:
+                self.write_message({"type": "end"})
+            else:
+                self.send_step(step)
+
+        elif msg["type"] == "reset":
+            await application.restart()
+            self.step = None
+            self.send_step(0)
+
+        elif msg["type"] == "seek":
+            buffer = application.buffer
+            step = min(max(msg["step"], buffer.first), buffer.last)
+            application.want(step)
+            self.write_message({
+                "type": "viz_replay",
+                "first": buffer.first,
+                "step": step,
+                "data": application.get_replay(step)
+            })
+            self.step = step
+
+        else:
+            super().on_message(message)
+
+
+class BufferedServer(ModularServer):
+    """
+    ModularServer that runs the model ahead of the browser in a
+    background thread and plays the buffered frames.
+    """
+    socket_handler = (r"/ws", BufferedSocketHandler)
+    handlers = [
+        ModularServer.page_handler,
+        socket_handler,
+        ModularServer.static_handler,
+        ModularServer.local_handler
+    ]
+
+    def __init__(
+        self, model_cls, visualization_elements, name="Mesa Model",
+        model_params={}, ahead=50, history=500
+    ):
+        """
+        Args:
+            model_cls, visualization_elements, name, model_params:
+                as for ModularServer
+            ahead: steps the model runs beyond the furthest step asked for
+            history: steps that are kept for seeking
+        """
+        if ahead >= history:
+            raise ValueError("history must be longer than ahead")
+        self.ahead = ahead
+        self.history = history
+        self.playback = PlaybackControl()
+        self.executor = ThreadPoolExecutor(1)
+        self.worker = None
+        self.stepped = asyncio.Event()
+        self.wanted = asyncio.Event()
+        super().__init__(
+            model_cls,
+            list(visualization_elements) + [self.playback],
+            name,
+            model_params
+        )
+
+    def reset_model(self):
+        super().reset_model()
+        self.buffer = FrameBuffer(self.history)
+        self.furthest = 0
+        self.buffer.append(*self.record(self.model))
+
+    def record(self, model):
+        """
+        Returns the states of the elements with a get_state method and
+        the frames of the other elements for the current step.
+        """
+        states = []
+        series = []
+        for element in self.visualization_elements:
+            if element is self.playback:
+                states.append(None)
+                series.append(None)
+            elif hasattr(element, "get_state"):
+                states.append(element.get_state(model))
+                series.append(None)
+            else:
+                states.append(None)
+                series.append(element.render(model))
+        return states, series
+
+    def advance(self, model):
+        """
+        Runs a step of the model and returns its states and frames.
+        """
+        model.step()
+        return self.record(model)
+
+    async def simulate(self, model, buffer):
+        """
+        Runs the model in the background thread while it is less than
+        ahead steps beyond the furthest step asked for.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while model.running:
+                if buffer.last - self.furthest >= self.ahead:
+                    self.wanted.clear()
+                    await self.wanted.wait()
+                    continue
+                states, series = await loop.run_in_executor(
+                    self.executor, self.advance, model
+                )
+                buffer.append(states, series)
+                self.stepped.set()
+        finally:
+            # browsers that wait for a step learn that none will come
+            self.stepped.set()
+
+    def start_worker(self):
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(
+                self.simulate(self.model, self.buffer)
+            )
+
+    async def restart(self):
+        """
+        Stops the worker, makes a new model and starts the worker again.
+        """
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+            # a step that is still running in the thread must finish
+            # before the elements record the new model
+            await asyncio.get_running_loop().run_in_executor(
+                self.executor, lambda: None
+            )
+        self.reset_model()
+        self.start_worker()
+
+    def want(self, step):
+        """
+        Notes that a browser asked for step, so the model may run further.
+        """
+        self.furthest = max(self.furthest, step)
+        self.wanted.set()
+
+    async def wait_for(self, step):
+        """
+        Waits until step is in the buffer or the model has stopped.
+        """
+        self.start_worker()
+        while step > self.buffer.last and not self.worker.done():
+            self.stepped.clear()
+            await self.stepped.wait()
+
+    def get_frames(self, step, shown=None):
+        """
+        Returns the frames of all elements for step, for a browser
+        that shows step shown.
+        """
+        buffer = self.buffer
+        states = buffer.get_states(step)
+        previous = buffer.get_states(shown) if shown in buffer else None
+        frames = []
+        for i, element in enumerate(self.visualization_elements):
+            if element is self.playback:
+                frames.append({
+                    "step": step,
+                    "first": buffer.first,
+                    "last": buffer.last
+                })
+            elif hasattr(element, "get_state"):
+                frames.append(element.encode(
+                    states[i], None if previous is None else previous[i]
+                ))
+            else:
+                frames.append(buffer.get_series(step)[i])
+        return frames
+
+    def get_replay(self, step):
+        """
+        Returns the frames that draw the browser again from the first
+        buffered step up to step: the frames of the elements without a
+        state for every step, and all frames for step itself.
+        """
+        buffer = self.buffer
+        return [
+            buffer.get_series(earlier)
+            for earlier in range(buffer.first, step)
+        ] + [self.get_frames(step)]
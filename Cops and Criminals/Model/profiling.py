@@ -0,0 +1,165 @@
+import time
+from collections import defaultdict
+
+from agents import Cop, Criminal
+
+# methods that are timed by default, by the class they belong to
+default_methods = {
+    # the risks and utilities are batched in the model methods below
+    Criminal: ['step', 'do_crime'],
+    Cop: [
+        'move_to_crime',
+        'random_cop_move',
+        'catch_criminal'
+    ],
+    'model': [
+        'redistribute_cops',
+        'update_risk_field',
+        'plan_criminal_moves',
+        'get_criminal_targets'
+    ],
+    # the phases of the array engine, for SugarscapeCg(engine='arrays')
+    'arrays': [
+        'update_risk_field',
+        'redistribute_cops',
+        'move_to_crime',
+        'resolve_cop_moves',
+        'catch_criminals'
+    ]
+}
+
+# phases of the array engine that run all agents of a breed
+engine_breeds = {'step_criminals': 'Criminal', 'step_cops': 'Cop'}
+
+
+class TimedMethod:
+    """
+    Stands in for a method of an object and adds the time
+    and the number of its calls to a profiler, and to the times of a
+    breed if the method runs all agents of that breed.
+    """
+    def __init__(self, profiler, name, obj, method, breed_name=None):
+        self.profiler = profiler
+        self.name = name
+        self.obj = obj
+        self.method = method
+        self.breed_name = breed_name
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return getattr(type(self.obj), self.method)(
+                self.obj, *args, **kwargs
+            )
+        finally:
+            elapsed = time.perf_counter() - start
+            self.profiler.calls[self.name] += 1
+            self.profiler.times[self.name] += elapsed
+            if self.breed_name is not None:
+                self.profiler.breed_times[self.breed_name].append(elapsed)
+
+
+class Profiler:
+    """
+    Opt-in instrumentation of SugarscapeCg.
+
+    Records the wall time of every breed in every step, the number of
+    calls and the cumulative time of the hot methods of the agents and
+    the model, and the time spent collecting data. The model only
+    creates a profiler when profile=True, otherwise nothing is timed
+    and nothing is wrapped.
+    """
+    def __init__(self, model, methods=default_methods):
+        self.model = model
+        self.methods = methods
+        self.breed_times = defaultdict(list)
+        self.calls = defaultdict(int)
+        self.times = defaultdict(float)
+
+        model.schedule.profiler = self
+        for method in methods.get('model', []):
+            self.wrap(model, f'model.{method}', method)
+
+    def wrap(self, obj, name, method, breed_name=None):
+        """
+        Replaces the method of a single object by a timed one.
+        """
+        setattr(
+            obj, method, TimedMethod(self, name, obj, method, breed_name)
+        )
+
+    def instrument(self, agent):
+        """
+        Times the methods of an agent that is added to the model.
+        """
+        agent_class = type(agent)
+        for method in self.methods.get(agent_class, []):
+            self.wrap(agent, f'{agent_class.__name__}.{method}', method)
+
+    def instrument_engine(self, engine):
+        """
+        Times the phases of the array engine, which has no agents: the
+        criminal and cop phases give the times of the breeds.
+        """
+        for method, breed_name in engine_breeds.items():
+            self.wrap(engine, f'ArrayEngine.{method}', method, breed_name)
+        for method in self.methods.get('arrays', []):
+            self.wrap(engine, f'ArrayEngine.{method}', method)
+
+    def instrument_collector(self, collector):
+        """
+        Times the data collection of the model.
+        """
+        self.wrap(collector, 'collect', 'collect')
+
+    def step_breed(self, schedule, breed):
+        """
+        Runs a breed of the schedule and records how long it took.
+        """
+        start = time.perf_counter()
+        schedule.step_breed(breed)
+        self.breed_times[breed.__name__].append(time.perf_counter() - start)
+
+    def get_column_reporters(self):
+        """
+        Returns the reporters of the step time of every breed,
+        to be collected as columns by the collector.
+        """
+        return {
+            'Criminal Time': self.get_criminal_time,
+            'Cop Time': self.get_cop_time
+        }
+
+    def get_criminal_time(self, model):
+        return self.get_breed_time('Criminal')
+
+    def get_cop_time(self, model):
+        return self.get_breed_time('Cop')
+
+    def get_breed_time(self, breed_name):
+        """
+        Returns the time the breed took in the last step.
+        """
+        times = self.breed_times[breed_name]
+        return times[-1] if times else 0.0
+
+    def report(self):
+        """
+        Returns the recorded timings as a dictionary.
+        """
+        return {
+            'steps': self.model.schedule.steps,
+            'breeds': {
+                breed_name: {
+                    'total': sum(times),
+                    'mean': sum(times) / len(times),
+                    'max': max(times),
+                    'per_step': list(times)
+                }
+                for breed_name, times in self.breed_times.items()
+            },
+            'methods': {
+                name: {'calls': self.calls[name], 'time': self.times[name]}
+                for name in sorted(self.calls)
+            }
+        }
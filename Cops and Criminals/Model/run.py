@@ -1,3 +1,18 @@
-from server import server
+import argparse
 
-server.launch()
+from server import server, make_buffered_server
+
+parser = argparse.ArgumentParser(description="Runs the visualization.")
+parser.add_argument(
+    '--buffered', action='store_true',
+    help='run the model ahead of the browser and allow seeking'
+)
+parser.add_argument('--ahead', type=int, default=50)
+parser.add_argument('--history', type=int, default=500)
+# mesa runserver passes its own arguments
+args, _ = parser.parse_known_args()
+
+if args.buffered:
+    make_buffered_server(args.ahead, args.history).launch()
+else:
+    server.launch()
@@ -18,6 +18,10 @@ class RandomActivationByBreed(RandomActivation):
     def __init__(self, model):
         super().__init__(model)
         self.agents_by_breed = defaultdict(dict)
+        # set by a Profiler to time every breed
+        self.profiler = None
+        # names of the model methods that run before a breed steps
+        self.breed_phases = {}
 
     def add(self, agent):
         """
@@ -49,10 +53,15 @@ class RandomActivationByBreed(RandomActivation):
             by_breed: If True, run all agents of a single breed before running
                       the next one.
         """
-        #Order is first sugar, then criminal, then cop
+        #Order is first criminal, then cop (sugar is grown by the model)
         if by_breed:
             for agent_class in self.agents_by_breed:
-                self.step_breed(agent_class)
+                if agent_class in self.breed_phases:
+                    getattr(self.model, self.breed_phases[agent_class])()
+                if self.profiler is None:
+                    self.step_breed(agent_class)
+                else:
+                    self.profiler.step_breed(self, agent_class)
             self.steps += 1
             self.time += 1
         else:
@@ -66,7 +75,7 @@ class RandomActivationByBreed(RandomActivation):
             breed: Class object of the breed to run.
         """
         agent_keys = list(self.agents_by_breed[breed].keys())
-        self.model.random.shuffle(agent_keys)
+        self.model.random_streams['schedule'].shuffle(agent_keys)
         for agent_key in agent_keys:
             self.agents_by_breed[breed][agent_key].step()
 
@@ -1,11 +1,10 @@
-from mesa.visualization.ModularVisualization import ModularServer
-from mesa.visualization.modules import CanvasGrid, ChartModule
+from mesa.visualization.modules import ChartModule
 
-from agents import Sugar, Cop, Criminal
+from agents import Cop, Criminal
 from model import SugarscapeCg
-
-from matplotlib import cm
-from matplotlib.colors import rgb2hex, ListedColormap
+from city_map import load_city_map
+from canvas import DeltaCanvasGrid, DeltaServer
+from playback import BufferedServer
 
 # colors of the grid
 color_dic = {
@@ -18,44 +17,27 @@ color_dic = {
     29: '#ffc0cb'
 }
 
-def SsAgent_portrayal(agent):
+# images of the agents, the last one is drawn on top
+agent_images = [
+    (Criminal, "resources/criminal.png", 0.9),
+    (Cop, "resources/cop.png", 0.9)
+]
+
+def sugar_color(amount):
     """
-    Function that handles the display of the cops and criminals.
+    Returns the color of a cell with an amount of sugar.
     """
-    if agent is None:
-        return
-
-    portrayal = {}
-
-    # display the criminals
-    if type(agent) is Criminal:
-        portrayal["Shape"] = "resources/criminal.png"
-        portrayal["scale"] = 0.9
-        portrayal["Layer"] = 1
-    
-    # display the cops
-    elif type(agent) is Cop:
-        portrayal["Shape"] = "resources/cop.png"
-        portrayal["scale"] = 0.9
-        portrayal["Layer"] = 1
-    
-
-    elif type(agent) is Sugar:
-        if agent.amount != 0:
-            portrayal["Color"] = color_dic.get(agent.amount, "#D5D9DC")
-        else:
-            portrayal["Color"] = "#D6F5D6"
-        portrayal["Shape"] = "rect"
-        portrayal["Filled"] = "true"
-        portrayal["Layer"] = 0
-        portrayal["w"] = 1
-        portrayal["h"] = 1
-    
-
-    return portrayal
+    if amount != 0:
+        return color_dic.get(amount, "#D5D9DC")
+    return "#D6F5D6"
 
 # Specify the canvas elements
-canvas_element = CanvasGrid(SsAgent_portrayal, 50, 50, 500, 500)
+# the canvas has a cell for every cell of the map
+grid_width, grid_height = load_city_map().shape
+# only the changes of the cells are sent after the first frame
+canvas_element = DeltaCanvasGrid(
+    sugar_color, agent_images, grid_width, grid_height, 500, 500
+)
 chart_element = ChartModule(
     [{"Label": "Criminal Wealth", "Color": "#AA0000"}]
 )
@@ -88,16 +70,31 @@ chart_element6 = ChartModule(
     ]
 )
 
+elements = [
+    canvas_element, 
+    chart_element,
+    chart_element3,
+    chart_element4,
+    chart_element5,
+    chart_element6
+]
+
 # Create the server
-server = ModularServer(
+server = DeltaServer(
     SugarscapeCg, 
-    [
-        canvas_element, 
-        chart_element,
-        chart_element3,
-        chart_element4,
-        chart_element5,
-        chart_element6
-    ], 
+    elements, 
     "Criminals versus Cops Amsterdam"
 )
+
+def make_buffered_server(ahead=50, history=500):
+    """
+    Returns a server that runs the model ahead of the browser in the
+    background and can seek in the last history steps.
+    """
+    return BufferedServer(
+        SugarscapeCg,
+        elements,
+        "Criminals versus Cops Amsterdam",
+        ahead=ahead,
+        history=history
+    )
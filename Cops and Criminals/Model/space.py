@@ -0,0 +1,61 @@
+import numpy as np
+from mesa.space import MultiGrid
+
+
+class OccupancyGrid(MultiGrid):
+    """
+    MultiGrid that keeps a count of the agents of every breed on every cell.
+
+    The occupancy layers are (width, height) arrays that are updated
+    whenever an agent is placed, moved or removed, so presence checks
+    and counts in a window are array lookups instead of scans of the
+    cell contents.
+
+    If a raster of region ids is given, the agents of every breed are also
+    counted per region, and these counts change only when an agent crosses
+    the border of a region.
+    """
+    def __init__(self, width, height, torus, breeds=(), regions=None):
+        super().__init__(width, height, torus)
+        self.occupancy = {
+            breed: np.zeros((width, height), dtype=int) for breed in breeds
+        }
+        self.regions = regions
+        if regions is not None:
+            self.region_occupancy = {
+                breed: np.zeros(regions.max() + 1, dtype=int)
+                for breed in breeds
+            }
+
+    def _place_agent(self, pos, agent):
+        x, y = pos
+        if agent not in self.grid[x][y]:
+            self.count_agent(pos, agent, 1)
+        super()._place_agent(pos, agent)
+
+    def _remove_agent(self, pos, agent):
+        super()._remove_agent(pos, agent)
+        self.count_agent(pos, agent, -1)
+
+    def count_agent(self, pos, agent, change):
+        """
+        Adds change to the counts of the breed of the agent
+        on the cell and in the region of pos.
+        """
+        layer = self.occupancy.get(type(agent))
+        if layer is None:
+            return
+        layer[pos] += change
+        if self.regions is not None:
+            self.region_occupancy[type(agent)][self.regions[pos]] += change
+
+    def get_window(self, layer, pos, radius):
+        """
+        Returns the view of a layer on the cells within radius of pos,
+        clipped to the grid, with the x and y of its first cell.
+        The view lists the cells in the order of get_neighborhood.
+        """
+        x, y = pos
+        x_min = max(x - radius, 0)
+        y_min = max(y - radius, 0)
+        return layer[x_min:x + radius + 1, y_min:y + radius + 1], x_min, y_min
@@ -0,0 +1,267 @@
+"""
+Columnar store for the outputs of experiments.
+
+Every experiment is a folder with one group per experiment value. The
+collected series of all replicates of a group are appended to a single
+binary file that is memory-mapped as a (replicate, step, metric) array
+when loaded, so loading is lazy and only the slices that are used are
+read from disk. An index.json next to it holds the experiment value with
+its type, the columns and the parameters, seed and code version of every
+replicate.
+
+The pickled experiment outputs of run_no_visual.ipynb can be converted
+from the Model folder with
+
+    python store.py experiment_outputs/experiment_output_cd.pkl
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from collector import ColumnarCollector
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+# files that determine the behaviour of the model
+model_files = [
+    'model.py', 'agents.py', 'schedule.py', 'collector.py', 'city_map.py',
+    'space.py', 'array_engine.py', 'kernels.py', 'batch.py'
+]
+
+# parameter varied in each of the pickled experiments of the notebook
+pickled_experiments = {
+    'baseline': None,
+    'cd': 'criminal_disconnectivity',
+    'ra': 'criminal_risk_aversion',
+    'jt': 'jail_sentence',
+    'crr': 'criminal_risk_radius',
+    'cocr': 'cop_catch_radius'
+}
+
+
+# types of the experiment values that are kept in index.json
+key_types = {'bool': bool, 'int': int, 'float': float, 'str': str}
+
+
+def sort_key(key):
+    """
+    Returns the key that orders experiment values: numbers by value,
+    then strings.
+    """
+    if isinstance(key, (bool, int, float)):
+        return (0, key, '')
+    return (1, 0, str(key))
+
+
+def code_version():
+    """
+    Returns a fingerprint of the source code of the model.
+    """
+    digest = hashlib.sha1()
+    for name in model_files:
+        with open(os.path.join(base_path, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class ExperimentData:
+    """
+    The replicates of one group of an experiment,
+    as a lazily loaded (replicate, step, metric) array.
+    """
+
+    def __init__(self, path, index):
+        self.path = path
+        self.columns = index['columns']
+        self.runs = index['runs']
+        self.steps = index['steps']
+        shape = (len(self.runs), self.steps, len(self.columns))
+        if len(self.runs) > 0:
+            self.array = np.memmap(
+                os.path.join(path, 'data.f8'),
+                dtype=np.float64,
+                mode='r',
+                shape=shape
+            )
+        else:
+            self.array = np.zeros(shape)
+
+    def __len__(self):
+        return len(self.runs)
+
+    def __getitem__(self, index):
+        return self.array[index]
+
+    def metric(self, name):
+        """
+        Returns the (replicate, step) view of a single metric.
+        """
+        return self.array[:, :, self.columns.index(name)]
+
+    def get_data(self, name):
+        """
+        Returns a metric as a (step, replicate) array,
+        like get_data in run_no_visual.ipynb.
+        """
+        return self.metric(name).T
+
+    def get_dataframes(self):
+        """
+        Returns every replicate as a DataFrame,
+        like the pickled experiment outputs.
+        """
+        import pandas as pd
+
+        return [
+            pd.DataFrame(np.asarray(replicate), columns=self.columns)
+            for replicate in self.array
+        ]
+
+
+class ExperimentStore:
+    """
+    An experiment stored on disk, with one group per experiment value.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def group_path(self, key):
+        return os.path.join(self.path, str(key))
+
+    def keys(self):
+        """
+        Returns the experiment values of the groups, with their original
+        type, in the order of their values.
+        """
+        keys = []
+        for name in os.listdir(self.path):
+            if os.path.exists(os.path.join(self.path, name, 'index.json')):
+                index = self.read_index(name)
+                if 'key' in index:
+                    keys.append(key_types[index['key_type']](index['key']))
+                else:
+                    # groups stored before the values were kept
+                    keys.append(name)
+        return sorted(keys, key=sort_key)
+
+    def read_index(self, key):
+        with open(os.path.join(self.group_path(key), 'index.json')) as f:
+            return json.load(f)
+
+    def append(
+        self, key, data, params=None, seed=None, version=None,
+        columns=ColumnarCollector.columns
+    ):
+        """
+        Appends the (step, metric) series of a replicate to a group.
+        data can also be a model, whose collected data is used.
+        """
+        if hasattr(data, 'datacollector'):
+            data = data.datacollector.get_array()
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        if isinstance(key, np.generic):
+            key = key.item()
+        if type(key).__name__ not in key_types:
+            raise TypeError(
+                f"Experiment value {key!r} is not one of "
+                f"{', '.join(key_types)}"
+            )
+
+        path = self.group_path(key)
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, 'index.json')):
+            index = self.read_index(key)
+            if (
+                index['columns'] != list(columns)
+                or index['steps'] != data.shape[0]
+            ):
+                raise ValueError(
+                    f"Replicate of shape {data.shape} does not match "
+                    f"group {key} with {index['steps']} steps "
+                    f"and columns {index['columns']}"
+                )
+        else:
+            index = {
+                'key': key,
+                'key_type': type(key).__name__,
+                'columns': list(columns),
+                'steps': data.shape[0],
+                'runs': []
+            }
+
+        # the data goes first, so the index never refers to missing rows
+        with open(os.path.join(path, 'data.f8'), 'ab') as f:
+            f.seek(len(index['runs']) * data.size * data.itemsize)
+            f.truncate()
+            f.write(data.tobytes())
+
+        index['runs'].append({
+            'params': params or {},
+            'seed': seed,
+            'code_version': version or code_version()
+        })
+        with open(os.path.join(path, 'index.json.tmp'), 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(
+            os.path.join(path, 'index.json.tmp'),
+            os.path.join(path, 'index.json')
+        )
+
+    def load(self, key):
+        """
+        Returns the replicates of a group, without reading them into memory.
+        """
+        return ExperimentData(self.group_path(key), self.read_index(key))
+
+    def __getitem__(self, key):
+        return self.load(key)
+
+
+def convert_pickle(pkl_path, store_path=None, parameter='infer'):
+    """
+    Converts a pickled {value: [DataFrame, ...]} experiment output
+    of run_no_visual.ipynb into an ExperimentStore.
+    """
+    import pandas as pd
+
+    name = os.path.splitext(os.path.basename(pkl_path))[0]
+    if parameter == 'infer':
+        parameter = pickled_experiments.get(
+            name.replace('experiment_output_', '')
+        )
+    if store_path is None:
+        store_path = os.path.join(os.path.dirname(pkl_path), name)
+
+    outputs = pd.read_pickle(pkl_path)
+    store = ExperimentStore(store_path)
+    if store.keys():
+        raise FileExistsError(f"{store_path} already holds an experiment")
+    for value, runs in outputs.items():
+        params = {} if parameter is None else {parameter: value}
+        for run in runs:
+            store.append(
+                value,
+                run.values,
+                params=params,
+                version='pickle',
+                columns=list(run.columns)
+            )
+    return store
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert pickled experiment outputs to experiment stores.'
+    )
+    parser.add_argument('pickles', nargs='+')
+    args = parser.parse_args()
+
+    for pkl_path in args.pickles:
+        store = convert_pickle(pkl_path)
+        print(pkl_path, '->', store.path)
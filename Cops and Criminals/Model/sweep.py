@@ -0,0 +1,497 @@
+"""
+Parallel, resumable runner for the Sobol sensitivity analysis.
+
+Runs SugarscapeCg for every row of a Saltelli sample on a process pool, 
+with a deterministic seed per row. Every finished row is appended to a 
+partial file next to the output, so an interrupted sweep continues 
+where it stopped. When all rows are done the output is written in the 
+CSV format read by the sensitivity_analysis_data notebook.
+
+Usage from the Model folder:
+
+    python sweep.py sensitivity_analysis_output.csv --samples 500
+
+With --target the sample grows in blocks of --block base samples until 
+the confidence of all Sobol indices is within the target, reusing all runs 
+of earlier blocks, and --samples is the maximum number of base samples:
+
+    python sweep.py sensitivity_analysis_output.csv --target 0.05 --samples 2048
+
+With --tolerance every run stops once its district averages have 
+converged (see convergence.py), and --steps is the maximum length of a run.
+Total crimes and Criminals in jail are then rates per step after the 
+warm-up, which do not depend on where a run stopped.
+"""
+
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import kernels
+from convergence import ConvergenceMonitor
+from model import SugarscapeCg
+
+# We define our variables and bounds
+problem = {
+    'num_vars': 5,
+    'names': [
+        'jail_sentence', 
+        'criminal_risk_radius', 
+        'cop_catch_radius', 
+        'criminal_risk_aversion', 
+        'criminal_disconnectivity'
+    ],
+    'bounds': [[0, 20], [1, 10], [1, 10], [0, 500], [0, 100]]
+}
+
+# Set the outputs
+model_reporters = {
+    "Total crimes": 
+    lambda m: 
+    m.schedule.get_crimes_commited(), 
+
+    "Criminals in jail": 
+    lambda m: 
+    m.schedule.get_criminal_count_in_jail(),
+
+    "Centrum": 
+    lambda m:
+    m.schedule.update_average_crimes_per_timestep("Centrum").get("Centrum"),
+
+    "Noord": 
+    lambda m:
+    m.schedule.update_average_crimes_per_timestep("Noord").get("Noord"),
+
+    "West": 
+    lambda m:
+    m.schedule.update_average_crimes_per_timestep("West").get("West"),
+
+    "Zuid": 
+    lambda m:
+    m.schedule.update_average_crimes_per_timestep("Zuid").get("Zuid"),
+
+    "Zuidoost": 
+    lambda m:
+    m.schedule.update_average_crimes_per_timestep("Zuidoost").get("Zuidoost"),
+
+    "Oost": 
+    lambda m:
+    m.schedule.update_average_crimes_per_timestep("Oost").get("Oost"),
+    
+    "Nieuw-West": 
+    lambda m:
+    m.schedule.update_average_crimes_per_timestep("Nieuw-West").get("Nieuw-West")
+}
+
+# columns of the output after the parameters, as in the notebook
+output_columns = [
+    'Run', 
+    'Centrum', 
+    'Criminals in jail', 
+    'Nieuw-West', 
+    'Noord', 
+    'Oost', 
+    'Total crimes', 
+    'West', 
+    'Zuid', 
+    'Zuidoost'
+]
+
+# columns added after the output when runs stop once they have converged
+convergence_columns = ['Stop step', 'Warm-up', 'Converged']
+
+# outputs analysed by the sensitivity_analysis_data notebook
+sensitivity_outputs = [
+    'Total crimes', 
+    'Criminals in jail', 
+    'Centrum', 
+    'Noord', 
+    'West', 
+    'Zuid', 
+    'Zuidoost', 
+    'Oost', 
+    'Nieuw-West'
+]
+
+
+def saltelli_rows(distinct_samples=500, problem=problem):
+    """
+    Returns the Saltelli sample of the problem, rounded to integers.
+    """
+    from SALib.sample import saltelli
+
+    param_values = saltelli.sample(
+        problem, 
+        N=distinct_samples, 
+        calc_second_order=False
+    )
+    return [np.rint(row).astype(int) for row in param_values]
+
+
+def saltelli_block(start, size, skip_values=512, problem=problem):
+    """
+    Returns the rows of the base samples start to start + size of the 
+    Saltelli sample, rounded to integers. Consecutive blocks make up the 
+    same rows as a single sample of all of them with the same skip_values, 
+    which is saltelli_rows for up to 512 base samples.
+    """
+    import warnings
+    from SALib.sample import saltelli
+
+    with warnings.catch_warnings():
+        # a block starts inside the sequence, which is skipped by 
+        # a power of 2 as a whole
+        warnings.simplefilter('ignore')
+        param_values = saltelli.sample(
+            problem, 
+            N=size, 
+            calc_second_order=False, 
+            skip_values=skip_values + start
+        )
+    return [np.rint(row).astype(int) for row in param_values]
+
+
+def row_seed(seed, run):
+    """
+    Returns the seed of a row, derived from the seed of the sweep.
+    """
+    return int(np.random.SeedSequence([seed, run]).generate_state(1)[0])
+
+
+def run_row(
+    run, values, seed, max_steps=300, names=problem['names'], 
+    convergence=None
+):
+    """
+    Runs the model for one row of parameter values 
+    and returns the row of the output.
+
+    If convergence holds the arguments of a ConvergenceMonitor, the run 
+    stops once it has converged, at max_steps at the latest. The districts 
+    then hold the average crimes after the detected warm-up instead of 
+    after the burn in period, and the convergence_columns are added.
+    As the runs stop at different steps, Total crimes and Criminals in 
+    jail are then per-step rates over the same window: the crimes per 
+    step and the average number of criminals in jail after the warm-up.
+    """
+    variable_parameters = {
+        name: int(val) for name, val in zip(names, values)
+    }
+
+    model = SugarscapeCg(seed=seed, **variable_parameters)
+    monitor = None
+    if convergence is not None:
+        monitor = ConvergenceMonitor(**convergence)
+    model.run_model(step_count=max_steps, convergence=monitor)
+
+    row = dict(variable_parameters)
+    row['Run'] = float(run)
+    for name, reporter in model_reporters.items():
+        row[name] = float(reporter(model))
+    if monitor is not None:
+        diagnostic = model.convergence
+        for district, mean in diagnostic['means'].items():
+            row[district] = float(mean)
+        # the first row is the state before the first step
+        collected = model.datacollector.get_array()[diagnostic['warm_up']:]
+        columns = model.datacollector.columns
+        crimes = collected[:, columns.index('Crimes commited')]
+        in_jail = collected[1:, columns.index('Criminal in Jail Count')]
+        row['Total crimes'] = float(crimes[-1] - crimes[0]) / len(in_jail)
+        row['Criminals in jail'] = float(in_jail.mean())
+        row['Stop step'] = float(diagnostic['stop_step'])
+        row['Warm-up'] = float(diagnostic['warm_up'])
+        row['Converged'] = float(diagnostic['converged'])
+    return row
+
+
+def run_forked_replicates(
+    replicates, burn_in=100, max_steps=300, seed=0, **parameters
+):
+    """
+    Runs the burn-in of a parameter setting once and branches 
+    the replicates off its snapshot. Returns the collected data 
+    of every replicate, including the shared burn-in steps.
+    """
+    model = SugarscapeCg(seed=seed, **parameters)
+    model.run_model(step_count=burn_in)
+    snapshot = model.snapshot()
+
+    outputs = []
+    for replicate in range(replicates):
+        model = SugarscapeCg.fork(snapshot, row_seed(seed, replicate))
+        model.run_model(step_count=max_steps - burn_in)
+        outputs.append(model.datacollector.get_model_vars_dataframe())
+    return outputs
+
+
+def partial_path(output_path):
+    """
+    Returns the path of the file the finished rows are streamed to.
+    """
+    return output_path + '.partial'
+
+
+def read_partial(path, names=problem['names'], extra_columns=()):
+    """
+    Returns the rows that were finished by an earlier run of the sweep, 
+    by run number. Incomplete lines from a crash are skipped.
+    """
+    columns = names + output_columns + list(extra_columns)
+    rows = {}
+    if not os.path.exists(path):
+        return rows
+
+    with open(path, newline='') as f:
+        for line in csv.reader(f):
+            if len(line) != len(columns) or line == columns:
+                continue
+            try:
+                row = {
+                    column: (int(val) if column in names else float(val))
+                    for column, val in zip(columns, line)
+                }
+            except ValueError:
+                continue
+            rows[int(row['Run'])] = row
+    return rows
+
+
+def read_output(output_path, names=problem['names'], extra_columns=()):
+    """
+    Returns the rows of a sweep written by write_output, by run number, 
+    or no rows if there is no such output.
+    """
+    if not os.path.exists(output_path):
+        return {}
+    data = pd.read_csv(output_path, index_col=0)
+    if list(data.columns) != names + output_columns + list(extra_columns):
+        return {}
+    return {int(row['Run']): row for row in data.to_dict('records')}
+
+
+def write_output(
+    output_path, rows, names=problem['names'], extra_columns=()
+):
+    """
+    Writes the finished sweep in the format of the notebook.
+    """
+    data = pd.DataFrame(
+        [rows[run] for run in sorted(rows)], 
+        columns=names + output_columns + list(extra_columns)
+    )
+    data.to_csv(output_path)
+    return data
+
+
+def run_sweep(
+    output_path, param_values, max_steps=300, seed=0, 
+    processes=None, names=problem['names'], verbose=True, convergence=None, 
+    done=None
+):
+    """
+    Runs all rows of param_values that are not finished yet on a pool 
+    of processes and returns the output as a DataFrame.
+    With convergence (see run_row) every run stops once it has converged.
+    Rows in done (by run number) are taken as finished.
+    """
+    extra_columns = convergence_columns if convergence is not None else []
+    columns = names + output_columns + extra_columns
+    path = partial_path(output_path)
+
+    # continue from the rows of an interrupted sweep
+    rows = read_partial(path, names, extra_columns)
+    if done is not None:
+        rows = {**done, **rows}
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for run in sorted(rows):
+            writer.writerow([rows[run][column] for column in columns])
+
+    todo = [run for run in range(len(param_values)) if run not in rows]
+    if verbose and rows:
+        print(f'Resuming with {len(rows)} of {len(param_values)} rows done')
+
+    # compile the kernels once, not in every worker
+    kernels.warm_up()
+    with open(path, 'a', newline='') as f, \
+            ProcessPoolExecutor(processes) as pool:
+        writer = csv.writer(f)
+        futures = [
+            pool.submit(
+                run_row, 
+                run, 
+                param_values[run], 
+                row_seed(seed, run), 
+                max_steps, 
+                names, 
+                convergence
+            )
+            for run in todo
+        ]
+        for future in as_completed(futures):
+            row = future.result()
+            writer.writerow([row[column] for column in columns])
+            f.flush()
+            rows[int(row['Run'])] = row
+
+            if verbose:
+                print(
+                    f'{len(rows) / len(param_values) * 100:.2f}% done', 
+                    end='\r'
+                )
+
+    data = write_output(output_path, rows, names, extra_columns)
+    os.remove(path)
+    return data
+
+
+def analyze(
+    data, problem=problem, outputs=sensitivity_outputs, 
+    num_resamples=100, seed=0
+):
+    """
+    Returns the first and total order Sobol indices of every output of 
+    a sweep, with their bootstrap confidence, like the notebook in 
+    sensitivity_analysis_data.
+    """
+    from SALib.analyze import sobol
+
+    return {
+        output: sobol.analyze(
+            problem, 
+            data[output].values, 
+            calc_second_order=False, 
+            num_resamples=num_resamples, 
+            # SALib only seeds the bootstrap with a nonzero seed
+            seed=None if seed is None else seed + 1
+        )
+        for output in outputs
+    }
+
+
+def largest_confidence(indices):
+    """
+    Returns the largest half width of the confidence intervals 
+    of the first and total order indices of all outputs.
+    """
+    return max(
+        float(np.nanmax(np.concatenate([Si['S1_conf'], Si['ST_conf']])))
+        for Si in indices.values()
+    )
+
+
+def run_progressive(
+    output_path, block_samples=64, max_samples=4096, target=0.05, 
+    min_samples=128, skip_values=512, max_steps=300, seed=0, 
+    processes=None, problem=problem, verbose=True, convergence=None
+):
+    """
+    Grows the Saltelli sample in blocks of block_samples base samples 
+    until the confidence intervals of all Sobol indices are at most 
+    target wide (half width), or max_samples base samples are run.
+
+    After every block the indices of all outputs are computed again from 
+    all rows run so far. The rows of earlier blocks are never run again, 
+    also not those in the output of an earlier call with the same 
+    output_path, seed and skip_values, so a study can be extended later.
+
+    Returns the output as a DataFrame, the indices of every output and 
+    the largest confidence half width after every analysed block.
+    """
+    names = problem['names']
+    rows_per_sample = len(names) + 2
+    extra_columns = convergence_columns if convergence is not None else []
+    rows = read_output(output_path, names, extra_columns)
+
+    param_values = []
+    indices = None
+    history = []
+    while len(param_values) < max_samples * rows_per_sample:
+        n_samples = len(param_values) // rows_per_sample
+        size = min(block_samples, max_samples - n_samples)
+        param_values.extend(
+            saltelli_block(n_samples, size, skip_values, problem)
+        )
+        n_samples += size
+
+        # reuse the rows that were run with the same values
+        done = {
+            run: row for run, row in rows.items() 
+            if run < len(param_values) 
+            and [row[name] for name in names] == list(param_values[run])
+        }
+        data = run_sweep(
+            output_path, param_values, max_steps, seed, processes, names, 
+            verbose, convergence, done
+        )
+        rows = {int(row['Run']): row for row in data.to_dict('records')}
+        if n_samples < min_samples:
+            continue
+
+        indices = analyze(data, problem, seed=seed)
+        history.append((n_samples, largest_confidence(indices)))
+        if verbose:
+            print(
+                f'{n_samples} samples: largest confidence '
+                f'{history[-1][1]:.4f}'
+            )
+        if history[-1][1] <= target:
+            break
+
+    return data, indices, history
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('output', help='path of the output CSV')
+    parser.add_argument('--samples', type=int, default=500)
+    parser.add_argument('--steps', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument(
+        '--tolerance', type=float, default=None, 
+        help='stop every run once the confidence interval of every '
+        'district is within this fraction of its mean'
+    )
+    parser.add_argument('--absolute_tolerance', type=float, default=0.25)
+    parser.add_argument(
+        '--target', type=float, default=None, 
+        help='grow the sample in blocks until the confidence of all Sobol '
+        'indices is within this half width, up to --samples base samples'
+    )
+    parser.add_argument('--block', type=int, default=64)
+    args = parser.parse_args()
+
+    convergence = None
+    if args.tolerance is not None:
+        convergence = {
+            'tolerance': args.tolerance, 
+            'absolute_tolerance': args.absolute_tolerance
+        }
+
+    if args.target is not None:
+        run_progressive(
+            args.output, 
+            block_samples=args.block, 
+            max_samples=args.samples, 
+            target=args.target, 
+            max_steps=args.steps, 
+            seed=args.seed, 
+            processes=args.processes, 
+            convergence=convergence
+        )
+    else:
+        run_sweep(
+            args.output, 
+            saltelli_rows(args.samples), 
+            max_steps=args.steps, 
+            seed=args.seed, 
+            processes=args.processes, 
+            convergence=convergence
+        )